@@ -7,12 +7,45 @@ Uses core_prompts.py for prompt definitions and processes product_classification
 """
 
 import os
+import logging
+import logging.handlers
+import queue
+import re
+import atexit
+import hashlib
+import shelve
+import argparse
+import io
+import time
+import threading
+import random
+import asyncio
+import heapq
+import functools
+import weakref
+import importlib.util
 import dotenv
+import httpx
+import numpy as np
+import pandas as pd
 from langchain_openai import AzureChatOpenAI
-import json
+from langchain_core.messages import SystemMessage, HumanMessage
+import openai
+from openai import AzureOpenAI
+import orjson
+import tenacity
 import csv
+from dataclasses import dataclass
 from datetime import datetime
-from core_prompts import get_prompt_for_product, format_prompt_with_data, get_available_products
+from operator import itemgetter
+try:
+    import uvloop  # optional, faster event loop on Linux/macOS
+except ImportError:
+    uvloop = None
+from core_prompts import (
+    get_prompt_for_product, format_prompt_with_data, get_available_products,
+    get_cta_variants, get_currency_symbol
+)
 
 # =============================================================================
 # AZURE OPENAI CONFIGURATION
@@ -21,41 +54,360 @@ from core_prompts import get_prompt_for_product, format_prompt_with_data, get_av
 # Load environment variables from .env file
 dotenv.load_dotenv()
 
-# Get Azure OpenAI configuration
-api_key = os.getenv("AZURE_OPENAI_API_KEY")
-endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
-api_version = os.getenv("AZURE_OPENAI_API_VERSION")
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+logger = logging.getLogger(__name__)
 
-def get_azure_llm():
-    """Initialize and return Azure OpenAI LLM instance"""
+def setup_logging() -> logging.handlers.QueueListener:
+    """
+    Send log records through a queue to a background thread that writes them to stderr,
+    so workers never block on console I/O.
+    
+    Returns:
+        The started listener; call stop() on it to flush remaining records
+    """
+    log_queue = queue.SimpleQueue()
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s [%(name)s] %(message)s"))
+    
+    root = logging.getLogger()
+    root.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    
+    listener = logging.handlers.QueueListener(log_queue, handler)
+    listener.start()
+    return listener
+
+AZURE_DEPLOYMENT = "gpt-4o-mini"
+TEMPERATURE = 0.7
+# Ask Azure OpenAI for a bare JSON object instead of free text
+RESPONSE_FORMAT = {"type": "json_object"}
+
+# Client-side throughput limits for bulk generation (0 disables the RPM/TPM limit)
+MAX_CONCURRENT_REQUESTS = int(os.getenv("AZURE_OPENAI_MAX_CONCURRENCY", "32"))
+REQUESTS_PER_MINUTE = int(os.getenv("AZURE_OPENAI_RPM", "0"))
+TOKENS_PER_MINUTE = int(os.getenv("AZURE_OPENAI_TPM", "0"))
+# Products whose notifications gain from LLM personalization; the rest are rendered from templates
+AZURE_PRODUCTS = frozenset(
+    product.strip()
+    for product in os.getenv(
+        "AZURE_OPENAI_PRODUCTS",
+        "Карта для путешествий,Премиальная карта,Кредитная карта,Обмен валют"
+    ).split(",")
+    if product.strip()
+)
+# Seed for the phrase and CTA choices of template notifications (unset for a different mix every run)
+TEMPLATE_RANDOM_SEED = os.getenv("TEMPLATE_RANDOM_SEED")
+# Location of the on-disk response cache (see NotificationCache)
+NOTIFICATION_CACHE_PATH = os.getenv("NOTIFICATION_CACHE_PATH", ".notif_cache")
+# Clients of the same product sent in one prompt; fewer requests under the RPM cap (1 = one call per client)
+CLIENTS_PER_PROMPT = int(os.getenv("AZURE_OPENAI_CLIENTS_PER_PROMPT", "8"))
+
+# Rough token estimate for rate limiting: Cyrillic prompts average ~3 characters per token
+CHARS_PER_TOKEN = 3
+RESPONSE_TOKENS = 150
+
+# Transient Azure OpenAI errors worth retrying, with exponential backoff and jitter
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError
+)
+MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 30.0
+
+# Keep-alive connection pools shared by all Azure OpenAI clients
+HTTP_LIMITS = httpx.Limits(max_keepalive_connections=32, max_connections=64)
+HTTP_TIMEOUT = 60.0
+# HTTP/2 multiplexing needs the optional h2 package (pip install httpx[http2])
+HTTP2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+# Reentrant because the client factories call each other during initialization
+_SINGLETON_LOCK = threading.RLock()
+
+def _singleton(factory):
+    """Cache a zero-argument factory so its object is built exactly once, even across threads"""
+    instance = []
+    
+    @functools.wraps(factory)
+    def wrapper():
+        if not instance:
+            with _SINGLETON_LOCK:
+                if not instance:
+                    instance.append(factory())
+        return instance[0]
+    
+    def reset():
+        """Forget and return the cached instance (None if not built), so the next call builds a new one"""
+        with _SINGLETON_LOCK:
+            return instance.pop() if instance else None
+    
+    wrapper.reset = reset
+    return wrapper
+
+def _loop_scoped(factory):
+    """Cache a zero-argument factory per running event loop; async connection pools can't outlive their loop"""
+    instances = weakref.WeakKeyDictionary()
+    
+    @functools.wraps(factory)
+    def wrapper():
+        loop = asyncio.get_running_loop()
+        if loop not in instances:
+            instances[loop] = factory()
+        return instances[loop]
+    
+    def discard():
+        """Forget and return the running loop's instance, if any"""
+        return instances.pop(asyncio.get_running_loop(), None)
+    
+    wrapper.discard = discard
+    return wrapper
+
+@_singleton
+def get_http_client() -> httpx.Client:
+    """Return the shared sync HTTP client, initializing it on first use"""
+    return httpx.Client(http2=HTTP2_AVAILABLE, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+@_loop_scoped
+def get_async_http_client() -> httpx.AsyncClient:
+    """Return the async HTTP client of the running event loop, initializing it on first use"""
+    return httpx.AsyncClient(http2=HTTP2_AVAILABLE, limits=HTTP_LIMITS, timeout=HTTP_TIMEOUT)
+
+@_singleton
+def get_azure_credentials() -> tuple:
+    """Read and validate the Azure OpenAI configuration once and return (api_key, endpoint, api_version)"""
+    # Read here rather than at import, so close_clients() picks up a changed environment
+    api_key = os.getenv("AZURE_OPENAI_API_KEY")
+    endpoint = os.getenv("AZURE_OPENAI_ENDPOINT")
+    api_version = os.getenv("AZURE_OPENAI_API_VERSION")
     if not all([api_key, endpoint, api_version]):
         raise ValueError("Missing required Azure OpenAI environment variables")
+    return api_key, endpoint, api_version
+
+def _create_azure_llm(**http_clients) -> AzureChatOpenAI:
+    """Build an Azure OpenAI LLM on the given shared HTTP client(s)"""
+    key, azure_endpoint, azure_api_version = get_azure_credentials()
     
     return AzureChatOpenAI(
-        api_key=api_key,
-        azure_endpoint=endpoint,
-        api_version=api_version,
-        azure_deployment="gpt-4o-mini",
-        temperature=0.7
+        api_key=key,
+        azure_endpoint=azure_endpoint,
+        api_version=azure_api_version,
+        azure_deployment=AZURE_DEPLOYMENT,
+        temperature=TEMPERATURE,
+        max_retries=0,  # Retries are handled by _invoke_with_retry / _ainvoke_with_retry
+        model_kwargs={"response_format": RESPONSE_FORMAT},
+        **http_clients
     )
 
+@_singleton
+def get_azure_llm():
+    """Return the shared Azure OpenAI LLM instance for sync calls, initializing it on first use"""
+    return _create_azure_llm(http_client=get_http_client())
+
+@_loop_scoped
+def get_async_azure_llm():
+    """Return the Azure OpenAI LLM instance for async calls on the running event loop"""
+    return _create_azure_llm(http_client=get_http_client(), http_async_client=get_async_http_client())
+
+@_singleton
+def get_azure_client():
+    """Return the shared Azure OpenAI SDK client for endpoints LangChain does not wrap (Batch API)"""
+    key, azure_endpoint, azure_api_version = get_azure_credentials()
+    
+    return AzureOpenAI(
+        api_key=key,
+        azure_endpoint=azure_endpoint,
+        api_version=azure_api_version,
+        http_client=get_http_client()
+    )
+
+def close_clients() -> None:
+    """
+    Drop the cached Azure OpenAI clients and close the shared sync HTTP client.
+    
+    The next get_* call rebuilds them from the current AZURE_OPENAI_* environment variables.
+    Async clients are per event loop and closed by aclose_async_clients.
+    """
+    for factory in (get_azure_llm, get_azure_client, get_azure_credentials):
+        factory.reset()
+    client = get_http_client.reset()
+    if client is not None:
+        client.close()
+
 # =============================================================================
 # DATA PROCESSING FUNCTIONS
 # =============================================================================
 
 def load_client_data(json_file_path: str) -> list:
     """Load client data from product_classification.json"""
-    with open(json_file_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    with open(json_file_path, 'rb') as f:
+        return orjson.loads(f.read())
+
+# Month names in prepositional case ("в январе"), indexed by month number - 1
+MONTH_NAMES_RU = (
+    'январе', 'феврале', 'марте', 'апреле', 'мае', 'июне',
+    'июле', 'августе', 'сентябре', 'октябре', 'ноябре', 'декабре'
+)
+
+# Product names from classification that differ from core_prompts.py definitions
+PRODUCT_NAME_MAPPING = {
+    "Депозит Мультивалютный": "Депозит мультивалютный",
+    "Депозит Сберегательный": "Депозит сберегательный", 
+    "Депозит Накопительный": "Депозит накопительный"
+}
 
+@functools.lru_cache(maxsize=None)
 def normalize_product_name(product_type: str) -> str:
     """Normalize product names to match core_prompts.py definitions"""
-    product_mapping = {
-        "Депозит Мультивалютный": "Депозит мультивалютный",
-        "Депозит Сберегательный": "Депозит сберегательный", 
-        "Депозит Накопительный": "Депозит накопительный"
+    return PRODUCT_NAME_MAPPING.get(product_type, product_type)
+
+def _extract_travel_card(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    # Get current month for personalization
+    month = MONTH_NAMES_RU[datetime.now().month - 1]
+    taxi_spent = category_spending.get('Такси', 0)
+    
+    return {
+        **base_data,
+        'taxi_rides_count': int(taxi_spent / 2000),  # Estimate rides
+        'taxi_spent_amount': taxi_spent,
+        'travel_spent_amount': category_spending.get('Путешествия', 0),
+        'hotels_spent_amount': category_spending.get('Отели', 0),
+        'month': month
+    }
+
+def _extract_premium_card(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    return {
+        **base_data,
+        'restaurants_spent': category_spending.get('Кафе и рестораны', 0),
+        'cosmetics_spent': category_spending.get('Косметика и Парфюмерия', 0),
+        'jewelry_spent': category_spending.get('Ювелирные украшения', 0),
+        'atm_withdrawals_count': int(type_spending.get('atm_withdrawal', 0) / 50000),  # Estimate count
+        'transfers_count': int(type_spending.get('p2p_out', 0) / 100000)  # Estimate count
+    }
+
+def _extract_credit_card(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    # Get top 3 categories
+    top_categories = [cat for cat, _ in heapq.nlargest(3, category_spending.items(), key=itemgetter(1))]
+    
+    return {
+        **base_data,
+        'top_category_1': top_categories[0] if len(top_categories) > 0 else 'Продукты питания',
+        'top_category_2': top_categories[1] if len(top_categories) > 1 else 'Кафе и рестораны',
+        'top_category_3': top_categories[2] if len(top_categories) > 2 else 'Такси',
+        'online_services_spent': (
+            category_spending.get('Едим дома', 0) + 
+            category_spending.get('Смотрим дома', 0) + 
+            category_spending.get('Играем дома', 0)
+        ),
+        'installment_payments': 'installment_payment_out' in type_spending,
+        'cc_repayments': 'cc_repayment_out' in type_spending
+    }
+
+def _extract_currency_exchange(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    # Determine main foreign currency based on client's actual currencies
+    client_currencies = client_data.get('currencies', ['KZT'])
+    foreign_currencies = [curr for curr in client_currencies if curr != 'KZT']
+    
+    if foreign_currencies:
+        # Client has foreign currencies, use the first one
+        main_foreign_currency = foreign_currencies[0]
+    else:
+        # Client only has KZT, don't suggest specific foreign currency
+        main_foreign_currency = 'иностранной валюте'
+    
+    # Always provide the required fields for the prompt
+    return {
+        **base_data,
+        'fx_buy_count': int(type_spending.get('fx_buy', 0) / 1000000),  # Estimate count
+        'fx_sell_count': int(type_spending.get('fx_sell', 0) / 1000000),  # Estimate count
+        'main_foreign_currency': main_foreign_currency
+    }
+
+def _extract_cash_loan(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    monthly_inflow = type_spending.get('salary_in', 0)
+    monthly_outflow = type_spending.get('card_out', 0)
+    
+    return {
+        **base_data,
+        'monthly_inflow': monthly_inflow,
+        'monthly_outflow': monthly_outflow,
+        'loan_payments_count': int(type_spending.get('loan_payment_out', 0) / 100000),  # Estimate count
+        'low_balance_days': 15 if monthly_outflow > monthly_inflow * 1.2 else 5,  # Estimate
+        'cash_need_indicators': monthly_outflow > monthly_inflow * 1.1
     }
-    return product_mapping.get(product_type, product_type)
+
+def _extract_multi_currency_deposit(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    return {
+        **base_data,
+        'free_balance': max(0, client_data['avg_monthly_balance'] - 50000),  # Estimate free balance
+        'fx_activity_score': min(10, int(type_spending.get('fx_buy', 0) / 500000)),  # 1-10 scale
+        'foreign_spending': category_spending.get('Путешествия', 0) + category_spending.get('Отели', 0),
+        'deposit_fx_topup_count': int(type_spending.get('deposit_fx_topup_out', 0) / 200000),  # Estimate
+        'deposit_fx_withdraw_count': int(type_spending.get('deposit_fx_withdraw_in', 0) / 200000)  # Estimate
+    }
+
+def _extract_savings_deposit(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    balance = client_data['avg_monthly_balance']
+    
+    return {
+        **base_data,
+        'stable_balance': balance,
+        'spending_volatility': 3 if balance > 500000 else 7,  # 1-10 scale
+        'deposit_topup_count': int(type_spending.get('deposit_topup_out', 0) / 200000),  # Estimate
+        'deposit_withdraw_count': 0,  # No withdrawals for savings deposit
+        'balance_stability_score': 9 if balance > 500000 else 5  # 1-10 scale
+    }
+
+def _extract_accumulative_deposit(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    deposit_topups = type_spending.get('deposit_topup_out', 0)
+    
+    return {
+        **base_data,
+        'regular_balance': client_data['avg_monthly_balance'],
+        'periodic_topups': deposit_topups > 0,
+        'topup_frequency': int(deposit_topups / 100000),  # Estimate frequency
+        'savings_behavior_score': 8 if deposit_topups > 500000 else 4,  # 1-10 scale
+        'small_regular_amounts': deposit_topups < 500000
+    }
+
+def _extract_investments(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    invest_in = type_spending.get('invest_in', 0)
+    
+    return {
+        **base_data,
+        'available_funds': max(0, client_data['avg_monthly_balance'] - 100000),  # Estimate available funds
+        'invest_in_count': int(invest_in / 200000),  # Estimate count
+        'invest_out_count': int(type_spending.get('invest_out', 0) / 200000),  # Estimate count
+        'investment_interest_score': 8 if invest_in > 0 else 3,  # 1-10 scale
+        'risk_tolerance': 7 if client_data['age'] < 35 else 5  # 1-10 scale
+    }
+
+def _extract_gold_bars(base_data: dict, category_spending: dict, type_spending: dict, client_data: dict) -> dict:
+    gold_buy = type_spending.get('gold_buy_out', 0)
+    
+    return {
+        **base_data,
+        'high_liquidity': client_data['avg_monthly_balance'] > 1000000,
+        'gold_buy_count': int(gold_buy / 500000),  # Estimate count
+        'gold_sell_count': int(type_spending.get('gold_sell_in', 0) / 500000),  # Estimate count
+        'jewelry_spent': category_spending.get('Ювелирные украшения', 0),
+        'value_preservation_interest': 8 if gold_buy > 0 else 5  # 1-10 scale
+    }
+
+# Product-specific data extractors, keyed by normalized product name
+PRODUCT_DATA_EXTRACTORS = {
+    "Карта для путешествий": _extract_travel_card,
+    "Премиальная карта": _extract_premium_card,
+    "Кредитная карта": _extract_credit_card,
+    "Обмен валют": _extract_currency_exchange,
+    "Кредит наличными": _extract_cash_loan,
+    "Депозит мультивалютный": _extract_multi_currency_deposit,
+    "Депозит сберегательный": _extract_savings_deposit,
+    "Депозит накопительный": _extract_accumulative_deposit,
+    "Инвестиции": _extract_investments,
+    "Золотые слитки": _extract_gold_bars
+}
 
 def extract_product_specific_data(client_data: dict, product_type: str) -> dict:
     """
@@ -75,173 +427,249 @@ def extract_product_specific_data(client_data: dict, product_type: str) -> dict:
         'currencies': client_data.get('currencies', ['KZT'])
     }
     
-    # Get current month for personalization
-    current_month = datetime.now().strftime('%B').lower()
-    month_names = {
-        'january': 'январе', 'february': 'феврале', 'march': 'марте',
-        'april': 'апреле', 'may': 'мае', 'june': 'июне',
-        'july': 'июле', 'august': 'августе', 'september': 'сентябре',
-        'october': 'октябре', 'november': 'ноябре', 'december': 'декабре'
-    }
-    month = month_names.get(current_month, 'августе')
+    extractor = PRODUCT_DATA_EXTRACTORS.get(normalized_product_type)
+    if extractor is None:
+        # Default fallback
+        return base_data
     
-    category_spending = client_data['top_5_category_spending']
-    type_spending = client_data['top_5_type_spending']
+    return extractor(
+        base_data,
+        client_data['top_5_category_spending'],
+        client_data['top_5_type_spending'],
+        client_data
+    )
+
+# =============================================================================
+# VECTORIZED DATA PROCESSING
+# =============================================================================
+
+CATEGORY_PREFIX = 'top_5_category_spending.'
+TYPE_PREFIX = 'top_5_type_spending.'
+BASE_COLUMNS = ['client_code', 'name', 'status', 'age', 'city', 'avg_monthly_balance_KZT', 'currencies']
+
+def clients_to_frame(clients_data: list) -> pd.DataFrame:
+    """Flatten client records into one row per client with a column per spending key"""
+    df = pd.json_normalize(clients_data)
+    # json_normalize turns a spending column into floats as soon as one client lacks the key or has a
+    # fractional amount; keep every client's own int or float so prompts match extract_product_specific_data
+    df = df.assign(**{
+        column: pd.Series([client[section].get(column[len(prefix):]) for client in clients_data],
+                          index=df.index, dtype=object)
+        for prefix, section in ((CATEGORY_PREFIX, 'top_5_category_spending'), (TYPE_PREFIX, 'top_5_type_spending'))
+        for column in df.columns
+        if column.startswith(prefix)
+    })
+    df['avg_monthly_balance_KZT'] = df['avg_monthly_balance']
+    if 'currencies' not in df:
+        df['currencies'] = None
+    df['currencies'] = [c if isinstance(c, list) else ['KZT'] for c in df['currencies']]
+    return df
+
+def _spending(df: pd.DataFrame, column: str) -> pd.Series:
+    """Spending column with 0 for clients that don't have this key"""
+    if column not in df:
+        return pd.Series(0, index=df.index)
+    return df[column].fillna(0)
+
+def _has_spending(df: pd.DataFrame, column: str) -> pd.Series:
+    if column not in df:
+        return pd.Series(False, index=df.index)
+    return df[column].notna()
+
+def _category(df: pd.DataFrame, name: str) -> pd.Series:
+    return _spending(df, CATEGORY_PREFIX + name)
+
+def _type(df: pd.DataFrame, name: str) -> pd.Series:
+    return _spending(df, TYPE_PREFIX + name)
+
+def _vector_travel_card(df: pd.DataFrame) -> dict:
+    taxi = _category(df, 'Такси')
+    return {
+        'taxi_rides_count': (taxi / 2000).astype(int),
+        'taxi_spent_amount': taxi,
+        'travel_spent_amount': _category(df, 'Путешествия'),
+        'hotels_spent_amount': _category(df, 'Отели'),
+        'month': MONTH_NAMES_RU[datetime.now().month - 1]
+    }
+
+def _vector_premium_card(df: pd.DataFrame) -> dict:
+    return {
+        'restaurants_spent': _category(df, 'Кафе и рестораны'),
+        'cosmetics_spent': _category(df, 'Косметика и Парфюмерия'),
+        'jewelry_spent': _category(df, 'Ювелирные украшения'),
+        'atm_withdrawals_count': (_type(df, 'atm_withdrawal') / 50000).astype(int),
+        'transfers_count': (_type(df, 'p2p_out') / 100000).astype(int)
+    }
+
+def _top_categories(df: pd.DataFrame, k: int = 3) -> np.ndarray:
+    """Names of each client's k largest spending categories, None where a client has fewer"""
+    category_columns = [c for c in df.columns if c.startswith(CATEGORY_PREFIX)]
+    names = np.array([c[len(CATEGORY_PREFIX):] for c in category_columns] + [None], dtype=object)
+    # Missing categories sort last and map to the None sentinel column
+    values = df[category_columns].to_numpy(dtype=float, na_value=-np.inf)
+    values = np.append(values, np.full((len(df), 1), -np.inf), axis=1)
     
-    if normalized_product_type == "Карта для путешествий":
-        return {
-            **base_data,
-            'taxi_rides_count': int(category_spending.get('Такси', 0) / 2000),  # Estimate rides
-            'taxi_spent_amount': category_spending.get('Такси', 0),
-            'travel_spent_amount': category_spending.get('Путешествия', 0),
-            'hotels_spent_amount': category_spending.get('Отели', 0),
-            'month': month
-        }
+    # Partition out the k largest values per row, then order only those
+    top_k = min(k, values.shape[1])
+    top = np.argpartition(-values, top_k - 1, axis=1)[:, :top_k]
+    order = np.argsort(-np.take_along_axis(values, top, axis=1), axis=1, kind='stable')
+    top = np.take_along_axis(top, order, axis=1)
+    top = np.where(np.take_along_axis(values, top, axis=1) == -np.inf, len(names) - 1, top)
     
-    elif normalized_product_type == "Премиальная карта":
-        return {
-            **base_data,
-            'restaurants_spent': category_spending.get('Кафе и рестораны', 0),
-            'cosmetics_spent': category_spending.get('Косметика и Парфюмерия', 0),
-            'jewelry_spent': category_spending.get('Ювелирные украшения', 0),
-            'atm_withdrawals_count': int(type_spending.get('atm_withdrawal', 0) / 50000),  # Estimate count
-            'transfers_count': int(type_spending.get('p2p_out', 0) / 100000)  # Estimate count
-        }
+    top_names = names[top]
+    if top_names.shape[1] < k:
+        top_names = np.pad(top_names, ((0, 0), (0, k - top_names.shape[1])), constant_values=None)
+    return top_names
+
+def _vector_credit_card(df: pd.DataFrame) -> dict:
+    top_names = _top_categories(df)
     
-    elif normalized_product_type == "Кредитная карта":
-        # Get top 3 categories
-        sorted_categories = sorted(category_spending.items(), key=lambda x: x[1], reverse=True)
-        top_categories = [cat[0] for cat in sorted_categories[:3]]
-        
-        return {
-            **base_data,
-            'top_category_1': top_categories[0] if len(top_categories) > 0 else 'Продукты питания',
-            'top_category_2': top_categories[1] if len(top_categories) > 1 else 'Кафе и рестораны',
-            'top_category_3': top_categories[2] if len(top_categories) > 2 else 'Такси',
-            'online_services_spent': (
-                category_spending.get('Едим дома', 0) + 
-                category_spending.get('Смотрим дома', 0) + 
-                category_spending.get('Играем дома', 0)
-            ),
-            'installment_payments': 'installment_payment_out' in type_spending,
-            'cc_repayments': 'cc_repayment_out' in type_spending
-        }
+    return {
+        'top_category_1': pd.Series(top_names[:, 0], index=df.index).fillna('Продукты питания'),
+        'top_category_2': pd.Series(top_names[:, 1], index=df.index).fillna('Кафе и рестораны'),
+        'top_category_3': pd.Series(top_names[:, 2], index=df.index).fillna('Такси'),
+        'online_services_spent': (
+            _category(df, 'Едим дома') +
+            _category(df, 'Смотрим дома') +
+            _category(df, 'Играем дома')
+        ),
+        'installment_payments': _has_spending(df, TYPE_PREFIX + 'installment_payment_out'),
+        'cc_repayments': _has_spending(df, TYPE_PREFIX + 'cc_repayment_out')
+    }
+
+def _vector_currency_exchange(df: pd.DataFrame) -> dict:
+    main_foreign_currency = [
+        next((curr for curr in currencies if curr != 'KZT'), 'иностранной валюте')
+        for currencies in df['currencies']
+    ]
+    return {
+        'fx_buy_count': (_type(df, 'fx_buy') / 1000000).astype(int),
+        'fx_sell_count': (_type(df, 'fx_sell') / 1000000).astype(int),
+        'main_foreign_currency': pd.Series(main_foreign_currency, index=df.index)
+    }
+
+def _vector_cash_loan(df: pd.DataFrame) -> dict:
+    monthly_inflow = _type(df, 'salary_in')
+    monthly_outflow = _type(df, 'card_out')
+    return {
+        'monthly_inflow': monthly_inflow,
+        'monthly_outflow': monthly_outflow,
+        'loan_payments_count': (_type(df, 'loan_payment_out') / 100000).astype(int),
+        'low_balance_days': np.where(monthly_outflow > monthly_inflow * 1.2, 15, 5),
+        'cash_need_indicators': monthly_outflow > monthly_inflow * 1.1
+    }
+
+def _vector_multi_currency_deposit(df: pd.DataFrame) -> dict:
+    return {
+        'free_balance': np.maximum(0, df['avg_monthly_balance'] - 50000),
+        'fx_activity_score': np.minimum(10, (_type(df, 'fx_buy') / 500000).astype(int)),
+        'foreign_spending': _category(df, 'Путешествия') + _category(df, 'Отели'),
+        'deposit_fx_topup_count': (_type(df, 'deposit_fx_topup_out') / 200000).astype(int),
+        'deposit_fx_withdraw_count': (_type(df, 'deposit_fx_withdraw_in') / 200000).astype(int)
+    }
+
+def _vector_savings_deposit(df: pd.DataFrame) -> dict:
+    high_balance = df['avg_monthly_balance'] > 500000
+    return {
+        'stable_balance': df['avg_monthly_balance'],
+        'spending_volatility': np.where(high_balance, 3, 7),
+        'deposit_topup_count': (_type(df, 'deposit_topup_out') / 200000).astype(int),
+        'deposit_withdraw_count': 0,
+        'balance_stability_score': np.where(high_balance, 9, 5)
+    }
+
+def _vector_accumulative_deposit(df: pd.DataFrame) -> dict:
+    topups = _type(df, 'deposit_topup_out')
+    return {
+        'regular_balance': df['avg_monthly_balance'],
+        'periodic_topups': topups > 0,
+        'topup_frequency': (topups / 100000).astype(int),
+        'savings_behavior_score': np.where(topups > 500000, 8, 4),
+        'small_regular_amounts': topups < 500000
+    }
+
+def _vector_investments(df: pd.DataFrame) -> dict:
+    invest_in = _type(df, 'invest_in')
+    return {
+        'available_funds': np.maximum(0, df['avg_monthly_balance'] - 100000),
+        'invest_in_count': (invest_in / 200000).astype(int),
+        'invest_out_count': (_type(df, 'invest_out') / 200000).astype(int),
+        'investment_interest_score': np.where(invest_in > 0, 8, 3),
+        'risk_tolerance': np.where(df['age'] < 35, 7, 5)
+    }
+
+def _vector_gold_bars(df: pd.DataFrame) -> dict:
+    gold_buy = _type(df, 'gold_buy_out')
+    return {
+        'high_liquidity': df['avg_monthly_balance'] > 1000000,
+        'gold_buy_count': (gold_buy / 500000).astype(int),
+        'gold_sell_count': (_type(df, 'gold_sell_in') / 500000).astype(int),
+        'jewelry_spent': _category(df, 'Ювелирные украшения'),
+        'value_preservation_interest': np.where(gold_buy > 0, 8, 5)
+    }
+
+# Vectorized counterparts of PRODUCT_DATA_EXTRACTORS
+VECTOR_DATA_EXTRACTORS = {
+    "Карта для путешествий": _vector_travel_card,
+    "Премиальная карта": _vector_premium_card,
+    "Кредитная карта": _vector_credit_card,
+    "Обмен валют": _vector_currency_exchange,
+    "Кредит наличными": _vector_cash_loan,
+    "Депозит мультивалютный": _vector_multi_currency_deposit,
+    "Депозит сберегательный": _vector_savings_deposit,
+    "Депозит накопительный": _vector_accumulative_deposit,
+    "Инвестиции": _vector_investments,
+    "Золотые слитки": _vector_gold_bars
+}
+
+def extract_all(df: pd.DataFrame, product_type: str) -> pd.DataFrame:
+    """
+    Vectorized extract_product_specific_data for many clients at once.
     
-    elif normalized_product_type == "Обмен валют":
-        # Determine main foreign currency based on client's actual currencies
-        client_currencies = client_data.get('currencies', ['KZT'])
-        foreign_currencies = [curr for curr in client_currencies if curr != 'KZT']
-        
-        if foreign_currencies:
-            # Client has foreign currencies, use the first one
-            main_foreign_currency = foreign_currencies[0]
-        else:
-            # Client only has KZT, don't suggest specific foreign currency
-            main_foreign_currency = 'иностранной валюте'
+    Args:
+        df: Client rows as built by clients_to_frame
+        product_type: Product to extract data for
         
-        # Always provide the required fields for the prompt
-        result_data = {
-            **base_data,
-            'fx_buy_count': int(type_spending.get('fx_buy', 0) / 1000000),  # Estimate count
-            'fx_sell_count': int(type_spending.get('fx_sell', 0) / 1000000),  # Estimate count
-            'main_foreign_currency': main_foreign_currency
-        }
-            
-        return result_data
+    Returns:
+        DataFrame with one row per client and the columns expected by the product prompt
+    """
+    result = df[BASE_COLUMNS].copy()
+    extractor = VECTOR_DATA_EXTRACTORS.get(normalize_product_name(product_type))
+    if extractor is not None:
+        for column, values in extractor(df).items():
+            result[column] = values
+    return result
+
+def extract_all_product_data(clients_data: list) -> list:
+    """
+    Extract product-specific data for every client, one vectorized pass per product.
     
-    elif normalized_product_type == "Кредит наличными":
-        monthly_inflow = type_spending.get('salary_in', 0)
-        monthly_outflow = type_spending.get('card_out', 0)
+    Args:
+        clients_data: Client data from JSON
         
-        return {
-            **base_data,
-            'monthly_inflow': monthly_inflow,
-            'monthly_outflow': monthly_outflow,
-            'loan_payments_count': int(type_spending.get('loan_payment_out', 0) / 100000),  # Estimate count
-            'low_balance_days': 15 if monthly_outflow > monthly_inflow * 1.2 else 5,  # Estimate
-            'cash_need_indicators': monthly_outflow > monthly_inflow * 1.1
-        }
-    
-    elif normalized_product_type == "Депозит мультивалютный":
-        return {
-            **base_data,
-            'free_balance': max(0, client_data['avg_monthly_balance'] - 50000),  # Estimate free balance
-            'fx_activity_score': min(10, int(type_spending.get('fx_buy', 0) / 500000)),  # 1-10 scale
-            'foreign_spending': category_spending.get('Путешествия', 0) + category_spending.get('Отели', 0),
-            'deposit_fx_topup_count': int(type_spending.get('deposit_fx_topup_out', 0) / 200000),  # Estimate
-            'deposit_fx_withdraw_count': int(type_spending.get('deposit_fx_withdraw_in', 0) / 200000)  # Estimate
-        }
-    
-    elif normalized_product_type == "Депозит сберегательный":
-        return {
-            **base_data,
-            'stable_balance': client_data['avg_monthly_balance'],
-            'spending_volatility': 3 if client_data['avg_monthly_balance'] > 500000 else 7,  # 1-10 scale
-            'deposit_topup_count': int(type_spending.get('deposit_topup_out', 0) / 200000),  # Estimate
-            'deposit_withdraw_count': 0,  # No withdrawals for savings deposit
-            'balance_stability_score': 9 if client_data['avg_monthly_balance'] > 500000 else 5  # 1-10 scale
-        }
-    
-    elif normalized_product_type == "Депозит накопительный":
-        return {
-            **base_data,
-            'regular_balance': client_data['avg_monthly_balance'],
-            'periodic_topups': type_spending.get('deposit_topup_out', 0) > 0,
-            'topup_frequency': int(type_spending.get('deposit_topup_out', 0) / 100000),  # Estimate frequency
-            'savings_behavior_score': 8 if type_spending.get('deposit_topup_out', 0) > 500000 else 4,  # 1-10 scale
-            'small_regular_amounts': type_spending.get('deposit_topup_out', 0) < 500000
-        }
+    Returns:
+        Product data dictionaries in the same order as clients_data
+    """
+    if not clients_data:
+        return []
     
-    elif normalized_product_type == "Инвестиции":
-        return {
-            **base_data,
-            'available_funds': max(0, client_data['avg_monthly_balance'] - 100000),  # Estimate available funds
-            'invest_in_count': int(type_spending.get('invest_in', 0) / 200000),  # Estimate count
-            'invest_out_count': int(type_spending.get('invest_out', 0) / 200000),  # Estimate count
-            'investment_interest_score': 8 if type_spending.get('invest_in', 0) > 0 else 3,  # 1-10 scale
-            'risk_tolerance': 7 if client_data['age'] < 35 else 5  # 1-10 scale
-        }
+    df = clients_to_frame(clients_data)
+    product_data = [None] * len(clients_data)
     
-    elif normalized_product_type == "Золотые слитки":
-        return {
-            **base_data,
-            'high_liquidity': client_data['avg_monthly_balance'] > 1000000,
-            'gold_buy_count': int(type_spending.get('gold_buy_out', 0) / 500000),  # Estimate count
-            'gold_sell_count': int(type_spending.get('gold_sell_in', 0) / 500000),  # Estimate count
-            'jewelry_spent': category_spending.get('Ювелирные украшения', 0),
-            'value_preservation_interest': 8 if type_spending.get('gold_buy_out', 0) > 0 else 5  # 1-10 scale
-        }
+    for product_type, group in df.groupby(df['product_type'].map(normalize_product_name), sort=False):
+        records = extract_all(group, product_type).to_dict('records')
+        for position, record in zip(group.index, records):
+            product_data[position] = record
     
-    else:
-        # Default fallback
-        return base_data
+    return product_data
 
 # =============================================================================
 # NOTIFICATION GENERATION
 # =============================================================================
 
-def generate_notification(product_name: str, **client_data) -> dict:
-    """
-    Generate a personalized push notification using Azure OpenAI.
-    
-    Args:
-        product_name: Name of the banking product
-        **client_data: Client and product-specific data
-        
-    Returns:
-        Dictionary with client_code, product, and push_notification
-    """
-    try:
-        # Get the prompt for the product
-        prompt = get_prompt_for_product(product_name)
-        
-        # Format the prompt with client data
-        formatted_prompt = format_prompt_with_data(prompt, **client_data)
-        
-        # Add humanization instructions to the prompt
-        humanization_instructions = """
-
-ВАЖНО: Создай уведомление, которое:
+# Static instructions go first (as the system message) so every request shares the
+# same prompt prefix, which lets Azure's prompt caching reuse it across clients
+HUMANIZATION_INSTRUCTIONS = """ВАЖНО: Создай уведомление, которое:
 - Звучит как личное сообщение от банка, а не автоматическая рассылка
 - Используй конкретные детали из трат клиента
 - Добавляй личные наблюдения ("заметили", "видим", "видно")
@@ -259,57 +687,278 @@ def generate_notification(product_name: str, **client_data) -> dict:
 
 Сделай уведомление живым и персональным!
 """
+
+# Sent as the same system message with every request
+SYSTEM_MESSAGE = SystemMessage(content=HUMANIZATION_INSTRUCTIONS)
+# Cached responses are only reused for the same deployment and system instructions
+CACHE_VERSION = f"{AZURE_DEPLOYMENT}:{hashlib.blake2b(HUMANIZATION_INSTRUCTIONS.encode('utf-8'), digest_size=8).hexdigest()}"
+
+def _build_prompt(product_name: str, client_data: dict) -> str:
+    """Build the client-specific LLM prompt for a product and client data"""
+    return format_prompt_with_data(get_prompt_for_product(product_name), **client_data)
+
+def _build_messages(prompt: str) -> list:
+    """Chat messages for one request: the shared system instructions, then the client prompt"""
+    return [SYSTEM_MESSAGE, HumanMessage(content=prompt)]
+
+# JSON mode shouldn't wrap replies in markdown fences, but tolerate it if the model does
+_FENCE = re.compile(r"^\s*```(?:json)?\s*(.*?)\s*```\s*$", re.DOTALL)
+
+def _parse_notification_response(content: str):
+    """Parse the JSON notification(s) returned by the LLM"""
+    match = _FENCE.match(content)
+    return orjson.loads(match.group(1) if match else content)
+
+class NotificationCache:
+    """
+    Content-addressed cache of generated notifications, persisted with shelve.
+    
+    Entries are keyed by a hash of the client prompt and tagged with CACHE_VERSION,
+    so changing the model, the system instructions or any prompt text misses the cache.
+    """
+    
+    def __init__(self, path: str, enabled: bool = True):
+        self.path = path
+        self.enabled = enabled
+        self._shelf = None
+        self._lock = threading.Lock()
+    
+    @staticmethod
+    def _key(prompt: str) -> str:
+        return hashlib.blake2b(prompt.encode('utf-8'), digest_size=16).hexdigest()
+    
+    def _open(self):
+        if self._shelf is None:
+            self._shelf = shelve.open(self.path)
+            atexit.register(self.close)
+        return self._shelf
+    
+    def get(self, prompt: str):
+        """Return a copy of the cached result for the prompt, or None"""
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._open().get(self._key(prompt))
+        if entry is None or entry.get('version') != CACHE_VERSION:
+            return None
+        return dict(entry['result'])
+    
+    def set(self, prompt: str, result: dict) -> None:
+        """Store a successful result for the prompt"""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._open()[self._key(prompt)] = {'version': CACHE_VERSION, 'result': dict(result)}
+    
+    def close(self) -> None:
+        with self._lock:
+            if self._shelf is not None:
+                self._shelf.close()
+                self._shelf = None
+
+# Successful responses survive between runs, so reruns skip the Azure call
+_notification_cache = NotificationCache(NOTIFICATION_CACHE_PATH)
+
+# Text of the push_notification field of rows whose generation failed
+ERROR_NOTIFICATION = "Ошибка генерации уведомления"
+
+def _is_error_result(result: dict) -> bool:
+    return result.get('push_notification', '').startswith(ERROR_NOTIFICATION)
+
+def _error_result(product_name: str, client_data: dict) -> dict:
+    """Fallback result returned when notification generation fails"""
+    return {
+        "client_code": client_data.get('client_code', 0),
+        "product": product_name,
+        "push_notification": ERROR_NOTIFICATION
+    }
+
+# Exponential backoff with full jitter on transient errors (429/5xx/timeouts)
+_retry_transient_errors = tenacity.retry(
+    retry=tenacity.retry_if_exception_type(RETRYABLE_ERRORS),
+    wait=tenacity.wait_random_exponential(multiplier=RETRY_BASE_DELAY, max=RETRY_MAX_DELAY),
+    stop=tenacity.stop_after_attempt(MAX_ATTEMPTS),
+    before_sleep=tenacity.before_sleep_log(logger, logging.WARNING),
+    reraise=True
+)
+
+@_retry_transient_errors
+def _invoke_with_retry(prompt, **kwargs):
+    """Call the LLM, retrying transient errors"""
+    return get_azure_llm().invoke(_build_messages(prompt), **kwargs)
+
+@_retry_transient_errors
+async def _ainvoke_with_retry(prompt, **kwargs):
+    """Async version of _invoke_with_retry"""
+    return await get_async_azure_llm().ainvoke(_build_messages(prompt), **kwargs)
+
+def generate_notification(product_name: str, **client_data) -> dict:
+    """
+    Generate a personalized push notification using Azure OpenAI.
+    
+    Args:
+        product_name: Name of the banking product
+        **client_data: Client and product-specific data
         
-        # Combine the formatted prompt with humanization instructions
-        full_prompt = formatted_prompt + humanization_instructions
-        
-        # Initialize Azure OpenAI LLM
-        llm = get_azure_llm()
+    Returns:
+        Dictionary with client_code, product, and push_notification
+    """
+    try:
+        prompt = _build_prompt(product_name, client_data)
+        cached = _notification_cache.get(prompt)
+        if cached is not None:
+            return cached
         
         # Generate the notification
-        response = llm.invoke(full_prompt)
+        response = _invoke_with_retry(prompt)
         
-        # Parse the JSON response (handle markdown formatting)
-        content = response.content.strip()
-        if content.startswith('```json'):
-            # Remove markdown formatting
-            content = content[7:]  # Remove ```json
-            if content.endswith('```'):
-                content = content[:-3]  # Remove ```
-        elif content.startswith('```'):
-            # Remove generic markdown formatting
-            content = content[3:]
-            if content.endswith('```'):
-                content = content[:-3]
+        try:
+            result = _parse_notification_response(response.content)
+        except orjson.JSONDecodeError:
+            # One deterministic retry before giving up on this client
+            response = _invoke_with_retry(prompt, temperature=0)
+            result = _parse_notification_response(response.content)
         
-        result = json.loads(content.strip())
+        _notification_cache.set(prompt, result)
+        return dict(result)
         
-        return result
+    except orjson.JSONDecodeError as e:
+        logger.error("Error parsing JSON response: %s\nRaw response: %s", e, response.content)
+        return _error_result(product_name, client_data)
+    except Exception as e:
+        logger.error("Error generating notification: %s", e)
+        return _error_result(product_name, client_data)
+
+async def agenerate_notification(product_name: str, **client_data) -> dict:
+    """
+    Async version of generate_notification, lets many Azure OpenAI requests
+    be in flight at the same time.
+    
+    Args:
+        product_name: Name of the banking product
+        **client_data: Client and product-specific data
         
-    except json.JSONDecodeError as e:
-        print(f"Error parsing JSON response: {e}")
-        print(f"Raw response: {response.content}")
-        return {
-            "client_code": client_data.get('client_code', 0),
-            "product": product_name,
-            "push_notification": "Ошибка генерации уведомления"
-        }
+    Returns:
+        Dictionary with client_code, product, and push_notification
+    """
+    try:
+        prompt = _build_prompt(product_name, client_data)
+        cached = _notification_cache.get(prompt)
+        if cached is not None:
+            return cached
+        
+        # Generate the notification without blocking the event loop
+        response = await _ainvoke_with_retry(prompt)
+        
+        try:
+            result = _parse_notification_response(response.content)
+        except orjson.JSONDecodeError:
+            # One deterministic retry before giving up on this client
+            response = await _ainvoke_with_retry(prompt, temperature=0)
+            result = _parse_notification_response(response.content)
+        
+        _notification_cache.set(prompt, result)
+        return dict(result)
+        
+    except orjson.JSONDecodeError as e:
+        logger.error("Error parsing JSON response: %s\nRaw response: %s", e, response.content)
+        return _error_result(product_name, client_data)
     except Exception as e:
-        print(f"Error generating notification: {e}")
-        return {
-            "client_code": client_data.get('client_code', 0),
-            "product": product_name,
-            "push_notification": "Ошибка генерации уведомления"
-        }
+        logger.error("Error generating notification: %s", e)
+        return _error_result(product_name, client_data)
+
 
+MARSHALED_PROMPT_HEADER = """
+Ниже {count} независимых заданий — по одному на каждого клиента, в блоках <CLIENT i>...</CLIENT i>.
+Выполни каждое задание отдельно, по данным и правилам из его блока.
+"""
+
+# Goes after the blocks, so the array format is the last instruction the model reads
+MARSHALED_PROMPT_FOOTER = """
+Верни ТОЛЬКО JSON-объект с массивом из {count} уведомлений — по одному на каждый блок <CLIENT i>, в порядке блоков:
+{{"notifications": [{{"client_code": <client_code из блока>, "product": "{product}", "push_notification": "текст уведомления"}}, ...]}}
+"""
+
+# Every product prompt ends with its single-object return format, which contradicts the array format
+_SINGLE_RETURN_INSTRUCTION = re.compile(r"\s*Верни ТОЛЬКО JSON в формате:.*\Z", re.DOTALL)
+
+def _build_marshaled_prompt(product_name: str, clients_product_data: list) -> str:
+    """Combine the prompts of several clients into one request"""
+    blocks = [
+        f"<CLIENT {i}>\n{_SINGLE_RETURN_INSTRUCTION.sub('', _build_prompt(product_name, client_data))}\n</CLIENT {i}>"
+        for i, client_data in enumerate(clients_product_data, 1)
+    ]
+    return "\n".join([
+        MARSHALED_PROMPT_HEADER.format(count=len(blocks)),
+        "\n\n".join(blocks),
+        MARSHALED_PROMPT_FOOTER.format(count=len(blocks), product=product_name),
+    ])
 
-def process_single_client(client_data: dict, use_azure: bool = True) -> dict:
+async def agenerate_notifications_batched(product_name: str, clients_product_data: list) -> list:
+    """
+    Generate notifications for several clients of one product with a single Azure OpenAI call.
+    
+    Args:
+        product_name: Name of the banking product
+        clients_product_data: Client and product-specific data, one dict per client
+        
+    Returns:
+        Results in the same order as clients_product_data. Clients missing from
+        the response are None, so the caller can schedule individual calls for
+        them under its own concurrency and rate limits.
+    """
+    results = [None] * len(clients_product_data)
+    pending = []
+    
+    for i, client_data in enumerate(clients_product_data):
+        cached = _notification_cache.get(_build_prompt(product_name, client_data))
+        if cached is not None:
+            results[i] = cached
+        else:
+            pending.append(i)
+    
+    generated = {}
+    if len(pending) > 1:
+        try:
+            prompt = _build_marshaled_prompt(product_name, [clients_product_data[i] for i in pending])
+            response = await _ainvoke_with_retry(prompt)
+            items = _parse_notification_response(response.content)
+            if isinstance(items, dict):
+                items = items.get('notifications', [items])
+            if not isinstance(items, list) or len(items) != len(pending):
+                logger.warning("Batched response for %s has %s notifications for %d clients",
+                               product_name, len(items) if isinstance(items, list) else "no", len(pending))
+            if isinstance(items, list):
+                generated = {
+                    str(item.get('client_code')): item
+                    for item in items
+                    if isinstance(item, dict) and item.get('push_notification')
+                }
+        except Exception as e:
+            logger.error("Error generating batched notifications for %s: %s", product_name, e)
+    
+    for i in pending:
+        client_data = clients_product_data[i]
+        item = generated.get(str(client_data.get('client_code')))
+        if item is None:
+            continue
+        item['client_code'] = client_data.get('client_code', item['client_code'])
+        _notification_cache.set(_build_prompt(product_name, client_data), item)
+        results[i] = dict(item)
+    
+    return results
+
+def process_single_client(client_data: dict, use_azure: bool = True, features: "ClientFeatures" = None,
+                          observation: str = None, cta: str = None) -> dict:
     """
     Process a single client and generate notification.
     
     Args:
         client_data: Client data from JSON
-        use_azure: Whether to use Azure OpenAI or template-based approach
+        use_azure: Whether to use Azure OpenAI (for products in AZURE_PRODUCTS) or only templates
+        features: Precomputed template features, computed here if not given
+        observation: Pre-drawn observation phrase for the template, drawn here if not given
+        cta: Pre-drawn call to action for the template, drawn here if not given
         
     Returns:
         Dictionary with client_code, product, and push_notification
@@ -318,7 +967,7 @@ def process_single_client(client_data: dict, use_azure: bool = True) -> dict:
     normalized_product_type = normalize_product_name(product_type)
     
     try:
-        if use_azure:
+        if use_azure and normalized_product_type in AZURE_PRODUCTS:
             # Extract product-specific data and generate with Azure OpenAI
             product_data = extract_product_specific_data(client_data, product_type)
             notification_result = generate_notification(normalized_product_type, **product_data)
@@ -333,7 +982,8 @@ def process_single_client(client_data: dict, use_azure: bool = True) -> dict:
             currencies = client_data.get('currencies', ['KZT'])
             
             notification_text = generate_template_notification(
-                normalized_product_type, name, age, status, category_spending, type_spending, currencies
+                normalized_product_type, name, age, status, category_spending, type_spending, currencies,
+                features=features, observation=observation, cta=cta
             )
             
             return {
@@ -343,24 +993,399 @@ def process_single_client(client_data: dict, use_azure: bool = True) -> dict:
             }
             
     except Exception as e:
-        print(f"  ✗ Error processing client {client_data['client_code']}: {e}")
+        logger.error("✗ Error processing client %s: %s", client_data['client_code'], e)
+        return {
+            "client_code": client_data['client_code'],
+            "product": product_type,
+            "push_notification": f"{ERROR_NOTIFICATION} для {product_type}"
+        }
+
+# =============================================================================
+# BATCH API
+# =============================================================================
+
+BATCH_FINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+BATCH_POLL_INTERVAL = 10.0
+BATCH_MAX_POLL_INTERVAL = 300.0
+
+def submit_batch(prompts: dict, poll_interval: float = BATCH_POLL_INTERVAL,
+                 max_poll_interval: float = BATCH_MAX_POLL_INTERVAL) -> dict:
+    """
+    Run many independent prompts as a single Azure OpenAI Batch API job.
+    
+    Args:
+        prompts: Prompt strings to send to the chat completions endpoint, keyed by custom_id
+        poll_interval: Seconds to wait before the first batch status check
+        max_poll_interval: Upper bound for the exponentially growing wait between checks
+        
+    Returns:
+        Response texts keyed by custom_id (None for failed requests)
+    """
+    client = get_azure_client()
+    
+    # Serialize all requests into one in-memory JSONL file
+    lines = [
+        orjson.dumps({
+            "custom_id": custom_id,
+            "method": "POST",
+            "url": "/chat/completions",
+            "body": {
+                "model": AZURE_DEPLOYMENT,
+                "messages": [
+                    {"role": "system", "content": HUMANIZATION_INSTRUCTIONS},
+                    {"role": "user", "content": prompt}
+                ],
+                "temperature": TEMPERATURE,
+                "response_format": RESPONSE_FORMAT
+            }
+        })
+        for custom_id, prompt in prompts.items()
+    ]
+    batch_file = io.BytesIO(b"\n".join(lines))
+    
+    uploaded = client.files.create(file=("notifications_batch.jsonl", batch_file), purpose="batch")
+    batch = client.batches.create(
+        input_file_id=uploaded.id,
+        endpoint="/chat/completions",
+        completion_window="24h"
+    )
+    logger.info("Submitted batch %s with %d requests", batch.id, len(prompts))
+    
+    # Wait for Azure to process the whole batch, backing off between checks
+    while batch.status not in BATCH_FINAL_STATUSES:
+        time.sleep(poll_interval)
+        poll_interval = min(poll_interval * 2, max_poll_interval)
+        batch = client.batches.retrieve(batch.id)
+        logger.info("Batch %s: %s", batch.id, batch.status)
+    
+    if batch.status != "completed":
+        raise RuntimeError(f"Batch {batch.id} finished with status: {batch.status}")
+    
+    # Index the results back by custom_id
+    contents = dict.fromkeys(prompts)
+    if batch.output_file_id:
+        output = client.files.content(batch.output_file_id)
+        for line in output.content.splitlines():
+            if not line.strip():
+                continue
+            record = orjson.loads(line)
+            response = record.get('response') or {}
+            if response.get('status_code') == 200:
+                contents[record['custom_id']] = response['body']['choices'][0]['message']['content']
+    
+    return contents
+
+def _batch_custom_id(index: int, client_data: dict) -> str:
+    """Batch request id for a row; the row index keeps it unique even if client codes repeat"""
+    return f"{index}-{client_data['client_code']}"
+
+def generate_notifications_with_batch_api(clients_data: list) -> list:
+    """
+    Generate notifications for all clients through the Azure OpenAI Batch API.
+    
+    Args:
+        clients_data: Client data from JSON
+        
+    Clients without a usable batch response (including every client when the
+    job itself fails or expires) are generated with realtime calls instead.
+    
+    Returns:
+        List of dictionaries with client_code, product, and push_notification
+    """
+    results = [None] * len(clients_data)
+    prompts = {}
+    
+    products_data = extract_all_product_data(clients_data)
+    for i, (client_data, product_data) in enumerate(zip(clients_data, products_data)):
+        product_type = client_data['product_type']
+        try:
+            prompt = _build_prompt(normalize_product_name(product_type), product_data)
+            cached = _notification_cache.get(prompt)
+            if cached is not None:
+                results[i] = cached
+            else:
+                prompts[_batch_custom_id(i, client_data)] = prompt
+        except Exception as e:
+            logger.error("✗ Error processing client %s: %s", client_data['client_code'], e)
+            results[i] = {
+                "client_code": client_data['client_code'],
+                "product": product_type,
+                "push_notification": f"{ERROR_NOTIFICATION} для {product_type}"
+            }
+    
+    try:
+        contents = submit_batch(prompts) if prompts else {}
+    except (RuntimeError, openai.OpenAIError) as e:
+        logger.error("✗ Batch job failed (%s); falling back to realtime calls for %d clients", e, len(prompts))
+        contents = None
+    
+    retry_indexes = []
+    for i, client_data in enumerate(clients_data):
+        if results[i] is not None:
+            continue
+        if contents is None:
+            retry_indexes.append(i)
+            continue
+        try:
+            custom_id = _batch_custom_id(i, client_data)
+            content = contents.get(custom_id)
+            if content is None:
+                raise ValueError("no response in batch output")
+            results[i] = _parse_notification_response(content)
+            _notification_cache.set(prompts[custom_id], results[i])
+        except Exception as e:
+            logger.error("✗ Error in batch response for client %s: %s", client_data['client_code'], e)
+            retry_indexes.append(i)
+    
+    if retry_indexes:
+        retried = run_async(agenerate_client_notifications([clients_data[i] for i in retry_indexes]))
+        for i, result in zip(retry_indexes, retried):
+            results[i] = result
+    
+    return results
+
+async def aprocess_single_client(client_data: dict, product_data: dict = None) -> dict:
+    """
+    Async counterpart of process_single_client for the Azure OpenAI path.
+    
+    Args:
+        client_data: Client data from JSON
+        product_data: Already extracted product-specific data, extracted here if not given
+        
+    Returns:
+        Dictionary with client_code, product, and push_notification
+    """
+    product_type = client_data['product_type']
+    normalized_product_type = normalize_product_name(product_type)
+    if normalized_product_type not in AZURE_PRODUCTS:
+        return process_single_client(client_data, use_azure=False)
+    
+    try:
+        if product_data is None:
+            product_data = extract_product_specific_data(client_data, product_type)
+        return await agenerate_notification(normalized_product_type, **product_data)
+    except Exception as e:
+        logger.error("✗ Error processing client %s: %s", client_data['client_code'], e)
         return {
             "client_code": client_data['client_code'],
             "product": product_type,
-            "push_notification": f"Ошибка генерации уведомления для {product_type}"
+            "push_notification": f"{ERROR_NOTIFICATION} для {product_type}"
         }
 
+async def aclose_async_clients() -> None:
+    """Close the running event loop's async LLM and HTTP client; call before the loop shuts down"""
+    get_async_azure_llm.discard()
+    client = get_async_http_client.discard()
+    if client is not None:
+        await client.aclose()
+
+async def _run_and_close_clients(coro):
+    try:
+        return await coro
+    finally:
+        await aclose_async_clients()
+
+def run_async(coro):
+    """Run a coroutine to completion, on uvloop when it is installed, closing the loop's async clients after"""
+    coro = _run_and_close_clients(coro)
+    if uvloop is not None:
+        with asyncio.Runner(loop_factory=uvloop.new_event_loop) as runner:
+            return runner.run(coro)
+    return asyncio.run(coro)
+
+class AsyncRateLimiter:
+    """Token bucket that spaces out requests to stay under per-minute request and token limits"""
+    
+    def __init__(self, requests_per_minute: int = 0, tokens_per_minute: int = 0):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.available_requests = float(requests_per_minute)
+        self.available_tokens = float(tokens_per_minute)
+        self.last_update = time.monotonic()
+        self._lock = asyncio.Lock()
+    
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self.last_update) / 60.0
+        self.last_update = now
+        self.available_requests = min(
+            self.requests_per_minute,
+            self.available_requests + elapsed_minutes * self.requests_per_minute
+        )
+        self.available_tokens = min(
+            self.tokens_per_minute,
+            self.available_tokens + elapsed_minutes * self.tokens_per_minute
+        )
+    
+    async def acquire(self, tokens: int) -> None:
+        """Wait until one request using roughly `tokens` tokens fits in the limits"""
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return
+        
+        # A single request can never need more than the whole bucket
+        tokens = min(tokens, self.tokens_per_minute) if self.tokens_per_minute else 0
+        
+        async with self._lock:
+            while True:
+                self._refill()
+                has_request = not self.requests_per_minute or self.available_requests >= 1
+                has_tokens = not self.tokens_per_minute or self.available_tokens >= tokens
+                if has_request and has_tokens:
+                    self.available_requests -= 1
+                    self.available_tokens -= tokens
+                    return
+                await asyncio.sleep(0.1)
+
+def _estimate_tokens(product_name: str) -> int:
+    """Approximate prompt + response tokens for one notification request"""
+    try:
+        prompt_chars = len(get_prompt_for_product(product_name))
+    except ValueError:
+        prompt_chars = 0
+    return prompt_chars // CHARS_PER_TOKEN + RESPONSE_TOKENS
+
+async def agenerate_client_notifications(clients_data: list,
+                                         max_concurrency: int = MAX_CONCURRENT_REQUESTS,
+                                         requests_per_minute: int = REQUESTS_PER_MINUTE,
+                                         tokens_per_minute: int = TOKENS_PER_MINUTE,
+                                         clients_per_prompt: int = CLIENTS_PER_PROMPT,
+                                         on_result=None) -> list:
+    """
+    Generate Azure OpenAI notifications for all clients concurrently, preserving input order.
+    
+    Args:
+        clients_data: Client data from JSON
+        max_concurrency: Maximum number of requests in flight at once
+        requests_per_minute: Client-side request limit (0 to disable)
+        tokens_per_minute: Client-side token limit (0 to disable)
+        clients_per_prompt: Clients of the same product combined into one request
+        on_result: Optional callback called with (index, result) as soon as each client is done
+        
+    Returns:
+        List of dictionaries with client_code, product, and push_notification
+    """
+    products_data = extract_all_product_data(clients_data)
+    semaphore = asyncio.Semaphore(max_concurrency)
+    rate_limiter = AsyncRateLimiter(requests_per_minute, tokens_per_minute)
+    
+    async def process_one(i: int) -> dict:
+        client_data = clients_data[i]
+        async with semaphore:
+            await rate_limiter.acquire(_estimate_tokens(normalize_product_name(client_data['product_type'])))
+            return await aprocess_single_client(client_data, products_data[i])
+    
+    async def process(i: int) -> list:
+        return [(i, await process_one(i))]
+    
+    if clients_per_prompt <= 1:
+        jobs = [process(i) for i in range(len(clients_data))]
+    else:
+        # Group the Azure clients by product and send each group in prompts of clients_per_prompt clients;
+        # the others get templates through aprocess_single_client, as with one client per prompt
+        groups = {}
+        jobs = []
+        for i, client_data in enumerate(clients_data):
+            product_name = normalize_product_name(client_data['product_type'])
+            if product_name in AZURE_PRODUCTS:
+                groups.setdefault(product_name, []).append(i)
+            else:
+                jobs.append(process(i))
+        
+        async def process_chunk(product_name: str, indexes: list) -> list:
+            # Cached clients need no request, so only the rest is sent and charged to the rate limiter
+            results = {}
+            for i in indexes:
+                try:
+                    results[i] = _notification_cache.get(_build_prompt(product_name, products_data[i]))
+                except Exception:
+                    results[i] = None  # Reported by the call that generates it
+            pending = [i for i in indexes if results[i] is None]
+            
+            if len(pending) == 1:
+                results[pending[0]] = await process_one(pending[0])
+            elif pending:
+                async with semaphore:
+                    await rate_limiter.acquire(_estimate_tokens(product_name) * len(pending))
+                    try:
+                        batched = await agenerate_notifications_batched(
+                            product_name, [products_data[i] for i in pending]
+                        )
+                    except Exception as e:
+                        logger.error("✗ Error processing clients %s: %s", [clients_data[i]['client_code'] for i in pending], e)
+                        batched = [
+                            {
+                                "client_code": clients_data[i]['client_code'],
+                                "product": clients_data[i]['product_type'],
+                                "push_notification": f"{ERROR_NOTIFICATION} для {clients_data[i]['product_type']}"
+                            }
+                            for i in pending
+                        ]
+                results.update(zip(pending, batched))
+                
+                # Clients the batched response left out are retried one by one, still throttled
+                missing = [i for i in pending if results[i] is None]
+                if missing:
+                    logger.warning("Batched response for %s left out %d of %d clients, retrying them individually",
+                                   product_name, len(missing), len(pending))
+                    for i, result in zip(missing, await asyncio.gather(*(process_one(i) for i in missing))):
+                        results[i] = result
+            
+            return [(i, results[i]) for i in indexes]
+        
+        jobs.extend(
+            process_chunk(product_name, indexes[start:start + clients_per_prompt])
+            for product_name, indexes in groups.items()
+            for start in range(0, len(indexes), clients_per_prompt)
+        )
+    
+    # Hand over results in completion order, as soon as each request finishes
+    results = [None] * len(clients_data)
+    for finished in asyncio.as_completed(jobs):
+        for i, result in await finished:
+            results[i] = result
+            if on_result is not None:
+                on_result(i, result)
+    return results
+
+CSV_FIELDNAMES = ('client_code', 'product', 'push_notification')
+
+def _csv_row(result: dict) -> tuple:
+    """CSV row for a result, with empty cells for missing fields"""
+    return tuple(result.get(field, '') for field in CSV_FIELDNAMES)
+
 def save_results_to_csv(results: list, output_csv_path: str) -> None:
     """Save results to CSV file"""
     with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
-        fieldnames = ['client_code', 'product', 'push_notification']
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+        writer = csv.writer(csvfile)
         
-        writer.writeheader()
-        for result in results:
-            writer.writerow(result)
+        writer.writerow(CSV_FIELDNAMES)
+        writer.writerows(_csv_row(result) for result in results)
+
+class OrderedCSVWriter:
+    """
+    Write results to an open CSV file as they complete, in input order.
+    
+    Results that arrive early are held back until every earlier row has been
+    written, so only the out-of-order window is kept in memory.
+    """
+    
+    def __init__(self, csvfile):
+        self._file = csvfile
+        self._writer = csv.writer(csvfile)
+        self._pending = {}
+        self._next_index = 0
+        self._writer.writerow(CSV_FIELDNAMES)
+    
+    def add(self, index: int, result: dict) -> None:
+        """Record the result for the client at index and flush every row that is ready"""
+        self._pending[index] = result
+        while self._next_index in self._pending:
+            self._writer.writerow(_csv_row(self._pending.pop(self._next_index)))
+            self._next_index += 1
+        self._file.flush()
 
-def generate_all_notifications(json_file_path: str, output_csv_path: str, use_azure: bool = True) -> None:
+def generate_all_notifications(json_file_path: str, output_csv_path: str, use_azure: bool = True,
+                               use_batch_api: bool = True, return_results: bool = True) -> list:
     """
     Generate notifications for all clients and save to CSV file.
     
@@ -368,142 +1393,291 @@ def generate_all_notifications(json_file_path: str, output_csv_path: str, use_az
         json_file_path: Path to product_classification.json
         output_csv_path: Path for output CSV file
         use_azure: Whether to use Azure OpenAI or template-based approach
+        use_batch_api: Send the Azure OpenAI requests as one Batch API job (False for live calls)
+        return_results: Keep every result in memory and return it; False when only the CSV is needed
+        
+    Returns:
+        List of generated results, so callers don't need to re-read the CSV (None if return_results is False)
     """
-    print("Loading client data...")
+    logger.info("Loading client data...")
     clients_data = load_client_data(json_file_path)
     
-    method = "Azure OpenAI" if use_azure else "template-based"
-    print(f"Processing {len(clients_data)} clients using {method} approach...")
+    # Only products in AZURE_PRODUCTS are worth an Azure call
+    azure_indexes = [
+        i for i, client_data in enumerate(clients_data)
+        if use_azure and normalize_product_name(client_data['product_type']) in AZURE_PRODUCTS
+    ]
+    azure_index_set = set(azure_indexes)
+    template_indexes = [i for i in range(len(clients_data)) if i not in azure_index_set]
+    logger.info("Processing %d clients: %d with Azure OpenAI, %d template-based...",
+                len(clients_data), len(azure_indexes), len(template_indexes))
     
-    results = []
+    results = [None] * len(clients_data) if return_results else None
     
-    for i, client_data in enumerate(clients_data, 1):
-        print(f"Processing client {i}/{len(clients_data)}: {client_data['name']} (ID: {client_data['client_code']})")
+    # Rows are written as soon as they are ready, so a crash keeps the finished part
+    logger.info("Writing results to %s...", output_csv_path)
+    with open(output_csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        csv_writer = OrderedCSVWriter(csvfile)
         
-        result = process_single_client(client_data, use_azure)
-        results.append(result)
+        def on_result(i: int, result: dict) -> None:
+            client_data = clients_data[i]
+            if results is not None:
+                results[i] = result
+            csv_writer.add(i, result)
+            # Failures were already logged as errors where they happened
+            if not _is_error_result(result):
+                logger.info("✓ Generated notification for %s (ID: %s): %s",
+                            client_data['name'], client_data['client_code'], client_data['product_type'])
         
-        print(f"  ✓ Generated notification for {client_data['product_type']}")
+        template_clients = [clients_data[i] for i in template_indexes]
+        observations, ctas = draw_template_choices(template_clients)
+        for i, features, observation, cta in zip(
+            template_indexes, build_client_features(template_clients), observations, ctas
+        ):
+            on_result(i, process_single_client(
+                clients_data[i], use_azure=False, features=features, observation=observation, cta=cta
+            ))
+        
+        azure_clients = [clients_data[i] for i in azure_indexes]
+        if azure_clients and use_batch_api:
+            batch_results = generate_notifications_with_batch_api(azure_clients)
+            logger.info("✓ Batch completed for %d clients", len(batch_results))
+            for i, result in zip(azure_indexes, batch_results):
+                on_result(i, result)
+        elif azure_clients:
+            # Azure calls are network-bound, so send them all at once
+            run_async(agenerate_client_notifications(
+                azure_clients, on_result=lambda j, result: on_result(azure_indexes[j], result)
+            ))
     
-    # Save to CSV
-    print(f"\nSaving results to {output_csv_path}...")
-    save_results_to_csv(results, output_csv_path)
+    logger.info("✓ Successfully generated %d notifications", len(clients_data))
+    logger.info("✓ Results saved to %s", output_csv_path)
     
-    print(f"✓ Successfully generated {len(results)} notifications")
-    print(f"✓ Results saved to {output_csv_path}")
+    return results
 
-def generate_template_notification(product_type: str, name: str, age: int, status: str, 
-                                 category_spending: dict, type_spending: dict, currencies: list = None) -> str:
-    """Generate a template-based notification without Azure OpenAI"""
-    
-    # Get current month
-    current_month = datetime.now().strftime('%B').lower()
-    month_names = {
-        'january': 'январе', 'february': 'феврале', 'march': 'марте',
-        'april': 'апреле', 'may': 'мае', 'june': 'июне',
-        'july': 'июле', 'august': 'августе', 'september': 'сентябре',
-        'october': 'октябре', 'november': 'ноябре', 'december': 'декабре'
-    }
-    month = month_names.get(current_month, 'августе')
+# =============================================================================
+# TEMPLATE-BASED NOTIFICATIONS
+# =============================================================================
+
+# Humanized observation phrases
+OBSERVATION_PHRASES = (
+    "заметили, что",
+    "видим, что",
+    "видно, что",
+    "обратили внимание, что",
+    "видно по вашим тратам, что"
+)
+
+@dataclass(slots=True)
+class ClientFeatures:
+    """Spending aggregates used by the templates, computed once per client"""
+    taxi: float
+    travel: float
+    hotels: float
+    cosmetics: float
+    jewelry: float
+    salary_in: float
+    fx_buy: float
+    top3_categories: tuple
+    currency_symbol: str
+    has_foreign_currency: bool
     
-    # Import CTA variants function
-    from core_prompts import get_cta_variants
-    import random
+    @classmethod
+    def from_spending(cls, category_spending: dict, type_spending: dict, currencies: list = None) -> "ClientFeatures":
+        """Build features from the top-5 category and type spending of a client"""
+        get_category = category_spending.get
+        return cls(
+            taxi=get_category('Такси', 0),
+            travel=get_category('Путешествия', 0),
+            hotels=get_category('Отели', 0),
+            cosmetics=get_category('Косметика и Парфюмерия', 0),
+            jewelry=get_category('Ювелирные украшения', 0),
+            salary_in=type_spending.get('salary_in', 0),
+            fx_buy=type_spending.get('fx_buy', 0),
+            top3_categories=tuple(cat for cat, _ in heapq.nlargest(3, category_spending.items(), key=itemgetter(1))),
+            currency_symbol=get_currency_symbol(currencies[0]) if currencies else "₸",
+            has_foreign_currency=bool(currencies) and any(curr != 'KZT' for curr in currencies)
+        )
+
+def build_client_features(clients_data: list) -> list:
+    """Compute ClientFeatures for every client with one vectorized pass over the loaded data"""
+    if not clients_data:
+        return []
     
-    # Get random CTA for variety
-    cta_options = get_cta_variants(product_type)
-    cta = random.choice(cta_options)
+    df = clients_to_frame(clients_data)
+    top3 = _top_categories(df, 3).tolist()
+    columns = zip(
+        _category(df, 'Такси').tolist(),
+        _category(df, 'Путешествия').tolist(),
+        _category(df, 'Отели').tolist(),
+        _category(df, 'Косметика и Парфюмерия').tolist(),
+        _category(df, 'Ювелирные украшения').tolist(),
+        _type(df, 'salary_in').tolist(),
+        _type(df, 'fx_buy').tolist(),
+        top3,
+        df['currencies']
+    )
     
-    # Get currency symbol
-    from core_prompts import get_currency_symbol
-    if currencies and len(currencies) > 0:
-        currency_symbol = get_currency_symbol(currencies[0])
-    else:
-        currency_symbol = "₸"
-    
-    # Humanized observation phrases
-    observation_phrases = [
-        "заметили, что",
-        "видим, что", 
-        "видно, что",
-        "обратили внимание, что",
-        "видно по вашим тратам, что"
+    return [
+        ClientFeatures(
+            taxi=taxi,
+            travel=travel,
+            hotels=hotels,
+            cosmetics=cosmetics,
+            jewelry=jewelry,
+            salary_in=salary_in,
+            fx_buy=fx_buy,
+            top3_categories=tuple(cat for cat in top_categories if cat is not None),
+            currency_symbol=get_currency_symbol(currencies[0]) if currencies else "₸",
+            has_foreign_currency=any(curr != 'KZT' for curr in currencies)
+        )
+        for taxi, travel, hotels, cosmetics, jewelry, salary_in, fx_buy, top_categories, currencies in columns
     ]
+
+def draw_template_choices(clients_data: list, seed=TEMPLATE_RANDOM_SEED) -> tuple:
+    """
+    Draw the observation phrase and CTA of every client's template in bulk.
     
-    # Get random observation phrase
-    observation = random.choice(observation_phrases)
-    
-    if product_type == "Карта для путешествий":
-        taxi_spent = category_spending.get('Такси', 0)
-        travel_spent = category_spending.get('Путешествия', 0)
-        hotels_spent = category_spending.get('Отели', 0)
+    Args:
+        clients_data: Client data from JSON
+        seed: Seed for the random generator, None for a different draw every run
         
-        if taxi_spent > 100000 or travel_spent > 100000:
-            cashback = int((taxi_spent + travel_spent + hotels_spent) * 0.04)
-            return f"{name}, {observation} в {month} вы очень активно пользовались такси — {taxi_spent:,} {currency_symbol}. С картой для путешествий вернули бы около {cashback:,} {currency_symbol} кешбэка. {cta}."
-        else:
-            return f"{name}, {observation} вы часто путешествуете и пользуетесь такси. С картой для путешествий получили бы кешбэк с каждой поездки. {cta}."
+    Returns:
+        (observations, ctas) lists aligned with clients_data
+    """
+    rng = random.Random(seed)
+    observations = rng.choices(OBSERVATION_PHRASES, k=len(clients_data))
     
-    elif product_type == "Премиальная карта":
-        balance = type_spending.get('salary_in', 0)
-        restaurants = category_spending.get('Кафе и рестораны', 0)
-        cosmetics = category_spending.get('Косметика и Парфюмерия', 0)
-        jewelry = category_spending.get('Ювелирные украшения', 0)
-        
-        if balance > 1000000:
-            if cosmetics > 100000 or jewelry > 100000:
-                return f"{name}, {observation} у вас высокий остаток и активные траты на косметику и ювелирку. Премиальная карта даст до 5% кешбэка в этих категориях. {cta}."
-            else:
-                return f"{name}, {observation} у вас стабильно высокий остаток. Премиальная карта даст до 4% кешбэка на все покупки и бесплатные снятия. {cta}."
-        else:
-            return f"{name}, {observation} вы часто тратите в ресторанах. С премиальной картой получили бы повышенный кешбэк и бесплатные снятия. {cta}."
+    # One draw per product for all of its clients
+    indexes_by_product = {}
+    for i, client_data in enumerate(clients_data):
+        indexes_by_product.setdefault(normalize_product_name(client_data['product_type']), []).append(i)
     
-    elif product_type == "Кредитная карта":
-        # Get top 3 categories
-        sorted_categories = sorted(category_spending.items(), key=lambda x: x[1], reverse=True)
-        top_categories = [cat[0] for cat in sorted_categories[:3]]
-        
-        cat1 = top_categories[0] if len(top_categories) > 0 else 'Продукты питания'
-        cat2 = top_categories[1] if len(top_categories) > 1 else 'Кафе и рестораны'
-        cat3 = top_categories[2] if len(top_categories) > 2 else 'Такси'
-        
-        return f"{name}, {observation} вы часто тратите на {cat1.lower()}, {cat2.lower()} и {cat3.lower()}. Кредитная карта даст до 10% кешбэка именно в ваших любимых категориях. {cta}."
+    ctas = [None] * len(clients_data)
+    for product_type, indexes in indexes_by_product.items():
+        for i, cta in zip(indexes, rng.choices(get_cta_variants(product_type), k=len(indexes))):
+            ctas[i] = cta
     
-    elif product_type == "Обмен валют":
-        fx_activity = type_spending.get('fx_buy', 0)
-        foreign_currencies = [curr for curr in currencies if curr != 'KZT'] if currencies else []
-        
-        if foreign_currencies:
-            # Client has foreign currencies, use the first one
-            foreign_currency = foreign_currencies[0]
-            return f"{name}, {observation} вы часто работаете с валютой. В приложении выгодный обмен и авто-покупка по целевому курсу. {cta}."
-        elif fx_activity > 1000000:
-            return f"{name}, {observation} у вас активность с валютными операциями. В приложении выгодный обмен и авто-покупка по целевому курсу. {cta}."
-        else:
-            return f"{name}, {observation} вы можете работать с валютой. В приложении выгодный обмен валют и авто-покупка по целевому курсу. {cta}."
+    return observations, ctas
+
+@dataclass(frozen=True, slots=True)
+class TemplateContext:
+    """Everything a product template needs to render one notification"""
+    name: str
+    observation: str
+    cta: str
+    month: str
+    features: ClientFeatures
+
+def _format_amount(value) -> str:
+    """Format an amount with thousands separators (1,234,567)"""
+    return format(value, ',')
+
+def _template_travel_card(ctx: TemplateContext) -> str:
+    features = ctx.features
     
-    elif product_type == "Кредит наличными":
-        return f"{name}, {observation} у вас могут быть крупные траты. Если нужен запас — можно оформить кредит наличными с гибкими выплатами. {cta}."
+    if features.taxi > 100000 or features.travel > 100000:
+        cashback = int((features.taxi + features.travel + features.hotels) * 0.04)
+        taxi_spent = _format_amount(features.taxi)
+        return f"{ctx.name}, {ctx.observation} в {ctx.month} вы очень активно пользовались такси — {taxi_spent} {features.currency_symbol}. С картой для путешествий вернули бы около {_format_amount(cashback)} {features.currency_symbol} кешбэка. {ctx.cta}."
+    return f"{ctx.name}, {ctx.observation} вы часто путешествуете и пользуетесь такси. С картой для путешествий получили бы кешбэк с каждой поездки. {ctx.cta}."
+
+def _template_premium_card(ctx: TemplateContext) -> str:
+    features = ctx.features
     
-    elif product_type == "Депозит мультивалютный":
-        return f"{name}, {observation} у вас остаются свободные средства. Мультивалютный депозит даст проценты и удобство хранения в разных валютах. {cta}."
+    if features.salary_in > 1000000:
+        if features.cosmetics > 100000 or features.jewelry > 100000:
+            return f"{ctx.name}, {ctx.observation} у вас высокий остаток и активные траты на косметику и ювелирку. Премиальная карта даст до 5% кешбэка в этих категориях. {ctx.cta}."
+        return f"{ctx.name}, {ctx.observation} у вас стабильно высокий остаток. Премиальная карта даст до 4% кешбэка на все покупки и бесплатные снятия. {ctx.cta}."
+    return f"{ctx.name}, {ctx.observation} вы часто тратите в ресторанах. С премиальной картой получили бы повышенный кешбэк и бесплатные снятия. {ctx.cta}."
+
+def _template_credit_card(ctx: TemplateContext) -> str:
+    top_categories = ctx.features.top3_categories
     
-    elif product_type == "Депозит сберегательный":
-        return f"{name}, {observation} у вас стабильный остаток. Сберегательный депозит даст максимальную ставку за счёт отсутствия снятий. {cta}."
+    cat1 = top_categories[0] if len(top_categories) > 0 else 'Продукты питания'
+    cat2 = top_categories[1] if len(top_categories) > 1 else 'Кафе и рестораны'
+    cat3 = top_categories[2] if len(top_categories) > 2 else 'Такси'
     
-    elif product_type == "Депозит накопительный":
-        return f"{name}, {observation} вы регулярно откладываете средства. Накопительный депозит поможет эффективно копить с повышенной ставкой. {cta}."
+    return f"{ctx.name}, {ctx.observation} вы часто тратите на {cat1.lower()}, {cat2.lower()} и {cat3.lower()}. Кредитная карта даст до 10% кешбэка именно в ваших любимых категориях. {ctx.cta}."
+
+def _template_currency_exchange(ctx: TemplateContext) -> str:
+    if ctx.features.has_foreign_currency:
+        return f"{ctx.name}, {ctx.observation} вы часто работаете с валютой. В приложении выгодный обмен и авто-покупка по целевому курсу. {ctx.cta}."
+    if ctx.features.fx_buy > 1000000:
+        return f"{ctx.name}, {ctx.observation} у вас активность с валютными операциями. В приложении выгодный обмен и авто-покупка по целевому курсу. {ctx.cta}."
+    return f"{ctx.name}, {ctx.observation} вы можете работать с валютой. В приложении выгодный обмен валют и авто-покупка по целевому курсу. {ctx.cta}."
+
+def _template_cash_loan(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у вас могут быть крупные траты. Если нужен запас — можно оформить кредит наличными с гибкими выплатами. {ctx.cta}."
+
+def _template_multi_currency_deposit(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у вас остаются свободные средства. Мультивалютный депозит даст проценты и удобство хранения в разных валютах. {ctx.cta}."
+
+def _template_savings_deposit(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у вас стабильный остаток. Сберегательный депозит даст максимальную ставку за счёт отсутствия снятий. {ctx.cta}."
+
+def _template_accumulative_deposit(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} вы регулярно откладываете средства. Накопительный депозит поможет эффективно копить с повышенной ставкой. {ctx.cta}."
+
+def _template_investments(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у вас есть свободные средства. Инвестиции дадут возможность роста с низким порогом входа. {ctx.cta}."
+
+def _template_gold_bars(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у вас высокая ликвидность средств. Золотые слитки — надёжный защитный актив для диверсификации. {ctx.cta}."
+
+def _template_default(ctx: TemplateContext) -> str:
+    return f"{ctx.name}, {ctx.observation} у нас есть специальное предложение для вас. {ctx.cta}."
+
+TEMPLATE_HANDLERS = {
+    "Карта для путешествий": _template_travel_card,
+    "Премиальная карта": _template_premium_card,
+    "Кредитная карта": _template_credit_card,
+    "Обмен валют": _template_currency_exchange,
+    "Кредит наличными": _template_cash_loan,
+    "Депозит мультивалютный": _template_multi_currency_deposit,
+    "Депозит сберегательный": _template_savings_deposit,
+    "Депозит накопительный": _template_accumulative_deposit,
+    "Инвестиции": _template_investments,
+    "Золотые слитки": _template_gold_bars,
+}
+
+def generate_template_notification(product_type: str, name: str, age: int, status: str, 
+                                 category_spending: dict, type_spending: dict, currencies: list = None,
+                                 features: ClientFeatures = None, observation: str = None, cta: str = None) -> str:
+    """Generate a template-based notification without Azure OpenAI"""
+    if features is None:
+        features = ClientFeatures.from_spending(category_spending, type_spending, currencies)
     
-    elif product_type == "Инвестиции":
-        return f"{name}, {observation} у вас есть свободные средства. Инвестиции дадут возможность роста с низким порогом входа. {cta}."
+    # Get random CTA and phrase for variety, unless the caller drew them in bulk
+    if cta is None:
+        cta = random.choice(get_cta_variants(product_type))
+    if observation is None:
+        observation = random.choice(OBSERVATION_PHRASES)
     
-    elif product_type == "Золотые слитки":
-        return f"{name}, {observation} у вас высокая ликвидность средств. Золотые слитки — надёжный защитный актив для диверсификации. {cta}."
+    ctx = TemplateContext(
+        name=name,
+        observation=observation,
+        cta=cta,
+        month=MONTH_NAMES_RU[datetime.now().month - 1],
+        features=features
+    )
     
-    else:
-        return f"{name}, {observation} у нас есть специальное предложение для вас. {cta}."
+    return TEMPLATE_HANDLERS.get(product_type, _template_default)(ctx)
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate banking push notifications")
+    parser.add_argument("--realtime", action="store_true",
+                        help="call Azure OpenAI directly instead of submitting a Batch API job")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="ignore and don't update the on-disk response cache")
+    args = parser.parse_args()
+    
+    log_listener = setup_logging()
+    atexit.register(log_listener.stop)
+    
+    if args.no_cache:
+        _notification_cache.enabled = False
+    
     # Configuration
     JSON_FILE_PATH = "processed/product_classification.json"
     OUTPUT_CSV_PATH = "banking_notifications.csv"
@@ -513,24 +1687,24 @@ if __name__ == "__main__":
     print("based on client spending patterns from product_classification.json")
     print()
     
-    # Check if Azure OpenAI is available
+    # Check if Azure OpenAI is available; generation errors are not a reason to drop to templates
     try:
-        # Try to initialize Azure OpenAI
-        llm = get_azure_llm()
-        print("✓ Azure OpenAI connection available")
-        print("Using Azure OpenAI for notification generation...")
-        print()
-        
-        # Generate notifications with Azure OpenAI
-        generate_all_notifications(JSON_FILE_PATH, OUTPUT_CSV_PATH, use_azure=True)
-        
+        get_azure_llm()
+        use_azure = True
     except Exception as e:
+        use_azure = False
         print(f"⚠ Azure OpenAI not available: {e}")
         print("Falling back to template-based generation...")
         print()
-        
-        # Generate notifications with template-based approach
-        generate_all_notifications(JSON_FILE_PATH, OUTPUT_CSV_PATH, use_azure=False)
+    
+    if use_azure:
+        print("✓ Azure OpenAI connection available")
+        mode = "realtime API" if args.realtime else "Batch API"
+        print(f"Using Azure OpenAI ({mode}) for notification generation...")
+        print()
+    
+    generate_all_notifications(JSON_FILE_PATH, OUTPUT_CSV_PATH, use_azure=use_azure,
+                               use_batch_api=not args.realtime, return_results=False)
     
     print("\n=== Generation Complete ===")
     print(f"Results saved to: {OUTPUT_CSV_PATH}")
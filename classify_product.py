@@ -1,14 +1,23 @@
 import pandas as pd
 import numpy as np
+import pyarrow as pa
 from typing import Dict, List, Optional, Tuple
 from datetime import datetime, timedelta
 import os
+import asyncio
 import logging
+import hashlib
+import heapq
+import re
+import threading
 from dataclasses import dataclass
-import json
+from concurrent.futures import ThreadPoolExecutor
+from operator import itemgetter
+import orjson
 from dotenv import load_dotenv
 from langchain_openai import AzureChatOpenAI
-from langchain_core.messages import SystemMessage, HumanMessage
+from langchain_core.messages import SystemMessage
+from langchain_core.prompts import ChatPromptTemplate
 
 load_dotenv()
 
@@ -20,6 +29,27 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Concurrent LLM classifications in bulk mode; threads overlap the HTTP round-trips
+MAX_CLASSIFY_WORKERS = int(os.getenv("CLASSIFY_MAX_WORKERS", "16"))
+
+# Client profiles sent to the LLM in a single request by the batch classifier
+CLASSIFY_BATCH_SIZE = int(os.getenv("CLASSIFY_BATCH_SIZE", "10"))
+
+# Category name fragments that mark travel spending in the rule-based fallback
+TRAVEL_CATEGORY_KEYWORDS = ('travel', 'transport')
+
+# Column types for the Arrow CSV reader; amounts stay float64 so sums match the source data
+CLIENT_DTYPES = {'client_code': 'int32'}
+OPERATION_DTYPES = {'client_code': 'int32', 'amount': 'float64'}
+
+# Outermost JSON object in an LLM reply, compiled once for the response path
+_JSON_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# LLM recommendations are cached on disk by prompt hash; set to an empty string to disable
+RECOMMENDATION_CACHE_DIR = os.getenv(
+    "RECOMMENDATION_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "banking_reco")
+)
+
 # ============================================
 # Data Analysis Tools
 # ============================================
@@ -40,9 +70,102 @@ class ClientAnalyzer:
         self.transactions_df = transactions_df
         self.transfers_df = transfers_df
         
-        # Convert date columns to datetime
-        self.transactions_df['date'] = pd.to_datetime(self.transactions_df['date'])
-        self.transfers_df['date'] = pd.to_datetime(self.transfers_df['date'])
+        # Convert date columns to datetime (load_data already parses them)
+        for df in (self.transactions_df, self.transfers_df):
+            if not pd.api.types.is_datetime64_any_dtype(df['date']):
+                df['date'] = pd.to_datetime(df['date'])
+        
+        # Low-cardinality keys as categoricals/int32: smaller frames and cheaper groupby hashing
+        for df, columns in ((self.transactions_df, ('category', 'currency')), (self.transfers_df, ('type', 'currency'))):
+            for col in columns:
+                df[col] = df[col].astype('category')
+        # Shared currency categories so codes from both frames can be merged directly
+        self._currency_dtype = pd.CategoricalDtype(
+            self.transactions_df['currency'].cat.categories.union(self.transfers_df['currency'].cat.categories)
+        )
+        for df in (self.transactions_df, self.transfers_df):
+            df['currency'] = df['currency'].astype(self._currency_dtype)
+        for df in (self.clients_df, self.transactions_df, self.transfers_df):
+            df['client_code'] = df['client_code'].astype('int32')
+        
+        # Hash index on client_code for O(1) client lookups (first row wins on duplicates)
+        self._clients_by_code = self.clients_df.set_index('client_code', drop=False)
+        self._clients_by_code = self._clients_by_code[~self._clients_by_code.index.duplicated()]
+        
+        # Per-client aggregates computed once, so profile lookups don't rescan the dataframes
+        transactions_by_client = self.transactions_df.groupby('client_code', observed=True)
+        transfers_by_client = self.transfers_df.groupby('client_code', observed=True)
+        
+        # One fused named aggregation per frame instead of a groupby per statistic
+        self._transaction_summary = transactions_by_client.agg(
+            total_spending=('amount', 'sum'),
+            avg_transaction_amount=('amount', 'mean'),
+            max_transaction=('amount', 'max'),
+            min_transaction=('amount', 'min'),
+            first_date=('date', 'min'),
+            last_date=('date', 'max'),
+            count=('date', 'size'),
+        )
+        self._transfer_summary = transfers_by_client.agg(
+            first_date=('date', 'min'),
+            last_date=('date', 'max'),
+            count=('date', 'size'),
+        )
+        
+        category_stats = self.transactions_df.groupby(['client_code', 'category'], observed=True)['amount'].agg(['sum', 'size'])
+        self._category_sums = category_stats['sum']
+        # Distinct categories per client are just the rows of that grouping; no separate nunique pass
+        # Clients whose rows all lack a category have no groups; nunique() counted them as 0
+        self._transaction_summary['category_diversity'] = category_stats.groupby(
+            level='client_code', observed=True
+        ).size().reindex(self._transaction_summary.index, fill_value=0)
+        self._type_sums = self.transfers_df.groupby(['client_code', 'type'], observed=True)['amount'].sum()
+        self._currencies_by_client = self._distinct_currencies()
+        # Most frequent category per client from the counts above; the stable sort keeps ties in
+        # category order, so the smallest label wins like Series.mode().iloc[0]
+        most_frequent = category_stats['size'].sort_values(ascending=False, kind='stable').groupby(
+            level='client_code', observed=True
+        ).head(1)
+        self._category_modes = pd.Series(
+            most_frequent.index.get_level_values('category').tolist(),
+            index=most_frequent.index.get_level_values('client_code')
+        )
+        
+        # Plain-dict views keyed by client_code, so building a profile is a handful of dict reads
+        self._category_spending = self._spending_by_client(self._category_sums)
+        self._type_spending = self._spending_by_client(self._type_sums)
+        # Same gap for the mode: mode().iloc[0] gave None when a client had no categories
+        self._transaction_summary['most_frequent_category'] = self._category_modes.reindex(
+            self._transaction_summary.index
+        ).astype(object).replace({np.nan: None})
+        self._transaction_rows = self._transaction_summary.to_dict('index')
+        self._transfer_rows = self._transfer_summary.to_dict('index')
+        self._client_records = dict(zip(self._clients_by_code.index, self._clients_by_code.to_dict('records')))
+    
+    def _distinct_currencies(self) -> Dict[int, List[str]]:
+        """Sorted currencies per client across transactions and transfers, from one Arrow group_by"""
+        frames = (self.transactions_df, self.transfers_df)
+        currency_codes = pa.table({
+            'client_code': np.concatenate([df['client_code'].to_numpy() for df in frames]),
+            'currency': np.concatenate([df['currency'].cat.codes.to_numpy() for df in frames]),
+        })
+        distinct = currency_codes.group_by('client_code').aggregate([('currency', 'distinct')])
+        
+        categories = self._currency_dtype.categories
+        return {
+            client_code: categories[sorted(code for code in codes if code >= 0)].tolist()  # -1 marks a missing currency
+            for client_code, codes in zip(
+                distinct['client_code'].to_pylist(), distinct['currency_distinct'].to_pylist()
+            )
+        }
+    
+    @staticmethod
+    def _spending_by_client(sums: pd.Series) -> Dict[int, Dict[str, float]]:
+        """Split a (client_code, key) -> amount series into one dict per client"""
+        return {
+            client_code: client_sums.droplevel('client_code').to_dict()
+            for client_code, client_sums in sums.groupby(level='client_code', observed=True)
+        }
     
     def get_category_spending(self, client_code: str) -> Dict[str, float]:
         """
@@ -54,13 +177,7 @@ class ClientAnalyzer:
         Returns:
             Dictionary with category as key and total amount spent as value
         """
-        client_transactions = self.transactions_df[self.transactions_df['client_code'] == client_code]
-        
-        if client_transactions.empty:
-            return {}
-        
-        category_spending = client_transactions.groupby('category')['amount'].sum().to_dict()
-        return category_spending
+        return dict(self._category_spending.get(client_code, {}))
     
     def get_type_spending(self, client_code: str) -> Dict[str, float]:
         """
@@ -72,13 +189,7 @@ class ClientAnalyzer:
         Returns:
             Dictionary with type as key and total amount as value
         """
-        client_transfers = self.transfers_df[self.transfers_df['client_code'] == client_code]
-        
-        if client_transfers.empty:
-            return {}
-        
-        type_spending = client_transfers.groupby('type')['amount'].sum().to_dict()
-        return type_spending
+        return dict(self._type_spending.get(client_code, {}))
     
     def get_currencies_used(self, client_code: str) -> List[str]:
         """
@@ -88,18 +199,9 @@ class ClientAnalyzer:
             client_code: Unique client identifier
             
         Returns:
-            List of unique currencies used
+            List of unique currencies used, in sorted order
         """
-        transactions_currencies = self.transactions_df[
-            self.transactions_df['client_code'] == client_code
-        ]['currency'].unique().tolist()
-        
-        transfers_currencies = self.transfers_df[
-            self.transfers_df['client_code'] == client_code
-        ]['currency'].unique().tolist()
-        
-        all_currencies = list(set(transactions_currencies + transfers_currencies))
-        return all_currencies
+        return list(self._currencies_by_client.get(client_code, ()))
     
     def get_avg_monthly_balance(self, client_code: str) -> Optional[float]:
         """
@@ -111,12 +213,10 @@ class ClientAnalyzer:
         Returns:
             Average monthly balance in KZT or None if client not found
         """
-        client_data = self.clients_df[self.clients_df['client_code'] == client_code]
-        
-        if client_data.empty:
+        try:
+            return self._clients_by_code.at[client_code, 'avg_monthly_balance_KZT']
+        except KeyError:
             return None
-        
-        return client_data['avg_monthly_balance_KZT'].iloc[0]
     
     def get_comprehensive_client_profile(self, client_code: str) -> Dict:
         """
@@ -129,20 +229,24 @@ class ClientAnalyzer:
             Dictionary with complete client profile
         """
         logger.debug("Building comprehensive profile for client_code=%s", client_code)
-        client_info = self.clients_df[self.clients_df['client_code'] == client_code].to_dict('records')
+        client_info = self._client_records.get(client_code)
         
-        if not client_info:
+        if client_info is None:
             logger.warning("Client not found: client_code=%s", client_code)
             return {"error": "Client not found"}
         
+        # Read each client's aggregate rows once and derive every section from them
+        transaction_stats = self._transaction_rows.get(client_code)
+        transfer_stats = self._transfer_rows.get(client_code)
+        
         profile = {
-            "client_info": client_info[0],
-            "category_spending": self.get_category_spending(client_code),
-            "type_spending": self.get_type_spending(client_code),
+            "client_info": dict(client_info),
+            "category_spending": dict(self._category_spending.get(client_code, {})),
+            "type_spending": dict(self._type_spending.get(client_code, {})),
             "currencies_used": self.get_currencies_used(client_code),
-            "avg_monthly_balance_KZT": self.get_avg_monthly_balance(client_code),
-            "transaction_frequency": self._calculate_transaction_frequency(client_code),
-            "spending_patterns": self._analyze_spending_patterns(client_code)
+            "avg_monthly_balance_KZT": client_info['avg_monthly_balance_KZT'],
+            "transaction_frequency": self._frequency_from_stats(transaction_stats, transfer_stats),
+            "spending_patterns": self._patterns_from_stats(transaction_stats)
         }
         
         logger.debug(
@@ -154,45 +258,63 @@ class ClientAnalyzer:
         )
         return profile
     
+    def get_client_profiles(self, client_codes: List[str]) -> List[Dict]:
+        """
+        Build profiles for many clients from the precomputed aggregates
+        
+        Args:
+            client_codes: Client identifiers
+            
+        Returns:
+            List of profiles in the same order as client_codes
+        """
+        return [self.get_comprehensive_client_profile(client_code) for client_code in client_codes]
+    
     def _calculate_transaction_frequency(self, client_code: str) -> Dict:
         """Calculate transaction frequency metrics"""
-        client_transactions = self.transactions_df[self.transactions_df['client_code'] == client_code]
-        client_transfers = self.transfers_df[self.transfers_df['client_code'] == client_code]
+        return self._frequency_from_stats(
+            self._transaction_rows.get(client_code), self._transfer_rows.get(client_code)
+        )
+    
+    def _frequency_from_stats(self, transaction_stats: Optional[Dict], transfer_stats: Optional[Dict]) -> Dict:
+        """Frequency metrics from a client's transaction and transfer aggregate rows"""
+        date_stats = [stats for stats in (transaction_stats, transfer_stats) if stats is not None]
         
-        if client_transactions.empty and client_transfers.empty:
+        if not date_stats:
             return {"monthly_avg_transactions": 0, "monthly_avg_transfers": 0}
         
-        # Calculate date ranges
-        trans_dates = client_transactions['date'] if not client_transactions.empty else pd.Series()
-        transfer_dates = client_transfers['date'] if not client_transfers.empty else pd.Series()
+        transactions_count = transaction_stats['count'] if transaction_stats else 0
+        transfers_count = transfer_stats['count'] if transfer_stats else 0
         
-        all_dates = pd.concat([trans_dates, transfer_dates])
-        if all_dates.empty:
-            return {"monthly_avg_transactions": 0, "monthly_avg_transfers": 0}
+        # Calculate date range over both transactions and transfers
+        first_date = min(stats['first_date'] for stats in date_stats)
+        last_date = max(stats['last_date'] for stats in date_stats)
         
-        date_range_months = (all_dates.max() - all_dates.min()).days / 30.0
+        date_range_months = (last_date - first_date).days / 30.0
         date_range_months = max(date_range_months, 1)  # At least 1 month
         
         return {
-            "monthly_avg_transactions": len(client_transactions) / date_range_months,
-            "monthly_avg_transfers": len(client_transfers) / date_range_months,
-            "total_operations": len(client_transactions) + len(client_transfers)
+            "monthly_avg_transactions": transactions_count / date_range_months,
+            "monthly_avg_transfers": transfers_count / date_range_months,
+            "total_operations": transactions_count + transfers_count
         }
     
     def _analyze_spending_patterns(self, client_code: str) -> Dict:
         """Analyze spending patterns for better product recommendations"""
-        client_transactions = self.transactions_df[self.transactions_df['client_code'] == client_code]
-        
-        if client_transactions.empty:
+        return self._patterns_from_stats(self._transaction_rows.get(client_code))
+    
+    def _patterns_from_stats(self, stats: Optional[Dict]) -> Dict:
+        """Spending patterns from a client's transaction aggregate row"""
+        if not stats:
             return {}
         
         patterns = {
-            "total_spending": client_transactions['amount'].sum(),
-            "avg_transaction_amount": client_transactions['amount'].mean(),
-            "max_transaction": client_transactions['amount'].max(),
-            "min_transaction": client_transactions['amount'].min(),
-            "most_frequent_category": client_transactions['category'].mode().iloc[0] if not client_transactions['category'].mode().empty else None,
-            "category_diversity": len(client_transactions['category'].unique())
+            "total_spending": stats['total_spending'],
+            "avg_transaction_amount": stats['avg_transaction_amount'],
+            "max_transaction": stats['max_transaction'],
+            "min_transaction": stats['min_transaction'],
+            "most_frequent_category": stats['most_frequent_category'],
+            "category_diversity": int(stats['category_diversity'])
         }
         
         return patterns
@@ -209,6 +331,67 @@ class Product:
     key_features: List[str]
     target_audience: List[str]
 
+# Rule-based fallback as data: each rule is (conditions, scores). A rule fires when all of its
+# (feature, comparison, threshold) conditions hold; rules apply in order, so later scores win.
+FALLBACK_FEATURES = (
+    'balance', 'currency_count', 'category_diversity', 'total_spending', 'has_travel', 'excess_spending'
+)
+FALLBACK_RULES = (
+    # High balance products
+    ((('balance', np.greater, 6000000),),
+     (('Премиальная карта', 0.9), ('Депозит Сберегательный', 0.8))),
+    ((('balance', np.greater, 1000000), ('balance', np.less_equal, 6000000)),
+     (('Премиальная карта', 0.7), ('Депозит Накопительный', 0.75))),
+    # Multi-currency users
+    ((('currency_count', np.greater, 2),),
+     (('Обмен валют', 0.85), ('Депозит Мультивалютный', 0.8))),
+    # Travel spending
+    ((('has_travel', np.greater, 0),),
+     (('Карта для путешествий', 0.85),)),
+    # High transaction diversity
+    ((('category_diversity', np.greater, 5),),
+     (('Кредитная карта', 0.7),)),
+    # Low balance but active (spending above twice the balance)
+    ((('balance', np.less, 500000), ('excess_spending', np.greater, 0)),
+     (('Кредит наличными', 0.6), ('Кредитная карта', 0.75))),
+    # Investment potential
+    ((('balance', np.greater, 2000000),),
+     (('Инвестиции', 0.7), ('Золотые слитки', 0.6))),
+)
+
+def _compile_fallback_rules(rules):
+    """Flatten the rules table into a product order and a (rules, products) score matrix"""
+    products = tuple(dict.fromkeys(product for _, scores in rules for product, _ in scores))
+    score_matrix = np.full((len(rules), len(products)), np.nan)
+    for r, (_, scores) in enumerate(rules):
+        for product, score in scores:
+            score_matrix[r, products.index(product)] = score
+    return products, score_matrix
+
+_FALLBACK_PRODUCTS, _FALLBACK_SCORES = _compile_fallback_rules(FALLBACK_RULES)
+
+def score_fallback_rules(features: np.ndarray) -> np.ndarray:
+    """
+    Score clients with the rule-based fallback in one vectorized pass
+    
+    Args:
+        features: Array of shape (N, len(FALLBACK_FEATURES))
+        
+    Returns:
+        Array of shape (N, len(_FALLBACK_PRODUCTS)); NaN where no rule recommends the product
+    """
+    columns = {name: features[:, i] for i, name in enumerate(FALLBACK_FEATURES)}
+    fired = np.column_stack([
+        np.logical_and.reduce([compare(columns[name], threshold) for name, compare, threshold in conditions])
+        for conditions, _ in FALLBACK_RULES
+    ])
+    
+    # For each (client, product) take the score of the last fired rule that sets it
+    sets_product = fired[:, :, None] & ~np.isnan(_FALLBACK_SCORES)[None, :, :]
+    last_rule = sets_product.shape[1] - 1 - sets_product[:, ::-1, :].argmax(axis=1)
+    scores = _FALLBACK_SCORES[last_rule, np.arange(len(_FALLBACK_PRODUCTS))]
+    return np.where(sets_product.any(axis=1), scores, np.nan)
+
 class ProductRecommendationEngine:
     """OpenAI-based product recommendation system"""
     
@@ -246,6 +429,22 @@ class ProductRecommendationEngine:
         except Exception as e:
             logger.error("Error initializing Azure OpenAI client: %s", e)
         self.products = self._initialize_products()
+        
+        # Prompt parts that are identical for every client, built once
+        self._products_desc = "\n\n".join(
+            f"{name}: {prod.description}" for name, prod in self.products.items()
+        )
+        self._system_prompt = """You are a banking product recommendation expert. Based on client financial behavior, 
+        recommend suitable banking products. Return recommendations as JSON with product names as keys 
+        and confidence scores (0-1) as values. Consider client's spending patterns, balance, currencies used, 
+        and transaction behavior. Be precise and base recommendations on actual client data."""
+        
+        # System turn baked into the template; only the human prompt varies per call
+        self._prompt_template = ChatPromptTemplate.from_messages([
+            SystemMessage(content=self._system_prompt),
+            ("human", "{prompt}")
+        ])
+        self._chain = self._prompt_template | self.llm if self.llm else None
     
     def _initialize_products(self) -> Dict[str, Product]:
         """Initialize product definitions"""
@@ -322,30 +521,201 @@ class ProductRecommendationEngine:
         Returns:
             Dictionary with product names as keys and recommendation scores (0-1) as values
         """
-        # Prepare context for OpenAI
-        context = self._prepare_context(client_profile)
+        # Prepare context and prompt for OpenAI
+        prompt = self._create_classification_prompt(self._prepare_context(client_profile))
         
-        # Create prompt
-        prompt = self._create_classification_prompt(context)
+        cached = self._load_cached_recommendations(prompt)
+        if cached is not None:
+            logger.debug("Recommendation cache hit")
+            return cached
         
         try:
-            if not self.llm:
+            if not self._chain:
                 raise RuntimeError("Azure OpenAI client is not configured. Check environment variables.")
             logger.debug("Invoking LLM with context length=%d", len(prompt))
             # Call Azure OpenAI via LangChain
-            response = self.llm.invoke([
-                SystemMessage(content=self._get_system_prompt()),
-                HumanMessage(content=prompt)
-            ])
-            # Parse response
-            recommendations = self._parse_recommendations(response.content)
-            logger.info("Received %d recommendations from LLM", len(recommendations))
-            return recommendations
+            response = self._chain.invoke({"prompt": prompt})
+            return self._handle_llm_response(prompt, response)
         except Exception as e:
             logger.warning("LLM classification failed (%s). Using rule-based fallback.", e)
             # Fallback to rule-based classification
             return self._rule_based_classification(client_profile)
     
+    async def aclassify_client(self, client_profile: Dict) -> Dict[str, float]:
+        """Async variant of classify_client; awaits the LLM call instead of blocking a thread"""
+        prompt = self._create_classification_prompt(self._prepare_context(client_profile))
+        
+        cached = self._load_cached_recommendations(prompt)
+        if cached is not None:
+            logger.debug("Recommendation cache hit")
+            return cached
+        
+        try:
+            if not self._chain:
+                raise RuntimeError("Azure OpenAI client is not configured. Check environment variables.")
+            logger.debug("Invoking LLM with context length=%d", len(prompt))
+            response = await self._chain.ainvoke({"prompt": prompt})
+            return self._handle_llm_response(prompt, response)
+        except Exception as e:
+            logger.warning("LLM classification failed (%s). Using rule-based fallback.", e)
+            return self._rule_based_classification(client_profile)
+    
+    def _handle_llm_response(self, prompt: str, response) -> Dict[str, float]:
+        """Parse a single-client LLM response and cache non-empty recommendations"""
+        recommendations = self._parse_recommendations(response.content)
+        logger.info("Received %d recommendations from LLM", len(recommendations))
+        if recommendations:
+            self._store_cached_recommendations(prompt, recommendations)
+        return recommendations
+    
+    def classify_clients_batch(self, client_profiles: List[Dict], batch_size: int = CLASSIFY_BATCH_SIZE) -> List[Dict[str, float]]:
+        """
+        Classify several clients with one LLM request per batch_size profiles
+        
+        Clients missing from a batched answer (or whose batch fails) fall back to
+        classify_client, so each one still gets LLM or rule-based recommendations.
+        
+        Args:
+            client_profiles: Comprehensive client profiles from ClientAnalyzer
+            batch_size: Number of profiles per LLM request
+            
+        Returns:
+            List of recommendation dictionaries in the same order as client_profiles
+        """
+        prompts, results, batches, batch_prompts = self._plan_batches(client_profiles, batch_size)
+        
+        if batches:
+            # All batched requests go out concurrently; a failed one doesn't sink the others
+            responses = self._chain.batch(
+                batch_prompts, config={"max_concurrency": MAX_CLASSIFY_WORKERS}, return_exceptions=True
+            )
+            self._apply_batch_responses(prompts, results, batches, responses)
+        
+        return [
+            recommendations if recommendations is not None else self.classify_client(profile)
+            for profile, recommendations in zip(client_profiles, results)
+        ]
+    
+    async def aclassify_clients_batch(self, client_profiles: List[Dict], batch_size: int = CLASSIFY_BATCH_SIZE) -> List[Dict[str, float]]:
+        """Async variant of classify_clients_batch built on abatch/ainvoke"""
+        prompts, results, batches, batch_prompts = self._plan_batches(client_profiles, batch_size)
+        
+        if batches:
+            responses = await self._chain.abatch(
+                batch_prompts, config={"max_concurrency": MAX_CLASSIFY_WORKERS}, return_exceptions=True
+            )
+            self._apply_batch_responses(prompts, results, batches, responses)
+        
+        # Same cap on in-flight requests as the abatch call above
+        semaphore = asyncio.Semaphore(MAX_CLASSIFY_WORKERS)
+        
+        async def classify_one(profile: Dict) -> Dict[str, float]:
+            async with semaphore:
+                return await self.aclassify_client(profile)
+        
+        fallback = await asyncio.gather(*(
+            classify_one(profile)
+            for profile, recommendations in zip(client_profiles, results)
+            if recommendations is None
+        ))
+        fallback = iter(fallback)
+        return [
+            recommendations if recommendations is not None else next(fallback)
+            for recommendations in results
+        ]
+    
+    def _plan_batches(self, client_profiles: List[Dict], batch_size: int):
+        """
+        Resolve cache hits and group the remaining clients into batched prompts
+        
+        Without an LLM the remaining clients are scored by the rule-based fallback
+        in one pass and no batches are planned.
+        
+        Returns:
+            Tuple of (per-client prompts, per-client results with None for pending,
+            batches of client indexes, batched prompt inputs for the chain)
+        """
+        contexts = [self._prepare_context(profile) for profile in client_profiles]
+        prompts = [self._create_classification_prompt(context) for context in contexts]
+        results = [self._load_cached_recommendations(prompt) for prompt in prompts]
+        pending = [i for i, cached in enumerate(results) if cached is None]
+        
+        if not pending:
+            return prompts, results, [], []
+        
+        if not self._chain:
+            logger.warning("Azure OpenAI client is not configured. Using rule-based fallback for %d clients.", len(pending))
+            fallback = self._rule_based_classification_batch([client_profiles[i] for i in pending])
+            for i, recommendations in zip(pending, fallback):
+                results[i] = recommendations
+            return prompts, results, [], []
+        
+        batches = [pending[start:start + batch_size] for start in range(0, len(pending), batch_size)]
+        batch_prompts = [
+            {"prompt": self._create_batch_classification_prompt([contexts[i] for i in batch])}
+            for batch in batches
+        ]
+        logger.debug("Invoking LLM for %d clients in %d batched requests", len(pending), len(batches))
+        return prompts, results, batches, batch_prompts
+    
+    def _apply_batch_responses(self, prompts: List[str], results: List[Optional[Dict]], batches: List[List[int]], responses) -> None:
+        """Fill results (and the cache) from batched LLM responses; clients left as None need a retry"""
+        for batch, response in zip(batches, responses):
+            try:
+                if isinstance(response, Exception):
+                    raise response
+                batch_recommendations = self._parse_batch_recommendations(response.content)
+            except Exception as e:
+                logger.warning("Batch LLM classification failed (%s). Classifying clients one by one.", e)
+                continue
+            
+            for number, i in enumerate(batch, start=1):
+                recommendations = batch_recommendations.get(str(number))
+                if recommendations:
+                    self._store_cached_recommendations(prompts[i], recommendations)
+                    results[i] = recommendations
+            logger.info("Received recommendations for %d/%d clients from batched LLM call",
+                        sum(results[i] is not None for i in batch), len(batch))
+    
+    def _cache_path(self, prompt: str) -> Optional[str]:
+        """Cache file for a prompt; the deployment is part of the key so switching models misses"""
+        if not RECOMMENDATION_CACHE_DIR:
+            return None
+        key = hashlib.blake2b(
+            f"{self.azure_deployment}\n{self._get_system_prompt()}\n{prompt}".encode('utf-8'),
+            digest_size=16
+        ).hexdigest()
+        return os.path.join(RECOMMENDATION_CACHE_DIR, f"{key}.json")
+    
+    def _load_cached_recommendations(self, prompt: str) -> Optional[Dict[str, float]]:
+        """Return cached LLM recommendations for the prompt, or None (also for unreadable or malformed files)"""
+        path = self._cache_path(prompt)
+        if not path:
+            return None
+        try:
+            with open(path, "rb") as f:
+                cached = orjson.loads(f.read())
+            # Only non-empty recommendations are stored; anything else was truncated or edited
+            if not isinstance(cached, dict) or not cached:
+                return None
+            return self._normalize_scores(cached)
+        except (OSError, orjson.JSONDecodeError, ValueError, TypeError):
+            return None
+    
+    def _store_cached_recommendations(self, prompt: str, recommendations: Dict[str, float]) -> None:
+        """Persist LLM recommendations for the prompt; failures only cost a future cache miss"""
+        path = self._cache_path(prompt)
+        if not path:
+            return
+        try:
+            os.makedirs(RECOMMENDATION_CACHE_DIR, exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(orjson.dumps(recommendations))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning("Could not write recommendation cache %s: %s", path, e)
+    
     def _prepare_context(self, client_profile: Dict) -> str:
         """Prepare context string from client profile"""
         context_parts = []
@@ -363,20 +733,12 @@ class ProductRecommendationEngine:
         
         # Spending categories
         if client_profile.get('category_spending'):
-            top_categories = sorted(
-                client_profile['category_spending'].items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )[:3]
+            top_categories = heapq.nlargest(3, client_profile['category_spending'].items(), key=itemgetter(1))
             context_parts.append(f"Top spending categories: {', '.join([f'{cat[0]} ({cat[1]:,.0f})' for cat in top_categories])}")
         
         # Transfer types
         if client_profile.get('type_spending'):
-            top_types = sorted(
-                client_profile['type_spending'].items(), 
-                key=lambda x: x[1], 
-                reverse=True
-            )[:3]
+            top_types = heapq.nlargest(3, client_profile['type_spending'].items(), key=itemgetter(1))
             context_parts.append(f"Top transfer types: {', '.join([f'{t[0]} ({t[1]:,.0f})' for t in top_types])}")
         
         # Currencies
@@ -401,17 +763,11 @@ class ProductRecommendationEngine:
     
     def _get_system_prompt(self) -> str:
         """Get system prompt for OpenAI"""
-        return """You are a banking product recommendation expert. Based on client financial behavior, 
-        recommend suitable banking products. Return recommendations as JSON with product names as keys 
-        and confidence scores (0-1) as values. Consider client's spending patterns, balance, currencies used, 
-        and transaction behavior. Be precise and base recommendations on actual client data."""
+        return self._system_prompt
     
     def _create_classification_prompt(self, context: str) -> str:
         """Create classification prompt"""
-        products_desc = "\n\n".join([
-            f"{name}: {prod.description}" 
-            for name, prod in self.products.items()
-        ])
+        products_desc = self._products_desc
         
         prompt = f"""Based on the following client profile, recommend suitable banking products.
 
@@ -425,6 +781,29 @@ Return a JSON object with product names as keys and recommendation confidence sc
 Consider only products that match the client's actual behavior and needs.
 Example format: {{"Карта для путешествий": 0.85, "Депозит Накопительный": 0.65}}
 
+Recommendations:"""
+        
+        return prompt
+    
+    def _create_batch_classification_prompt(self, contexts: List[str]) -> str:
+        """Create one classification prompt covering several numbered clients"""
+        products_desc = self._products_desc
+        client_profiles = "\n\n".join(
+            f"Client {number}:\n{context}" for number, context in enumerate(contexts, start=1)
+        )
+        
+        prompt = f"""Based on the following client profiles, recommend suitable banking products for each client.
+
+{client_profiles}
+
+Available Products:
+{products_desc}
+
+Return a JSON object keyed by client number. Each value is a JSON object with product names as keys
+and recommendation confidence scores (0-1) as values.
+Consider only products that match each client's actual behavior and needs.
+Example format: {{"1": {{"Карта для путешествий": 0.85}}, "2": {{"Депозит Накопительный": 0.65}}}}
+
 Recommendations:"""
         
         return prompt
@@ -433,63 +812,73 @@ Recommendations:"""
         """Parse OpenAI response to extract recommendations"""
         try:
             # Try to extract JSON from response
-            import re
-            json_match = re.search(r'\{.*\}', response_text, re.DOTALL)
+            json_match = _JSON_RE.search(response_text)
             if json_match:
-                recommendations = json.loads(json_match.group())
-                # Normalize scores to 0-1 range
-                for product in recommendations:
-                    if product in self.products:
-                        recommendations[product] = max(0, min(1, float(recommendations[product])))
-                return recommendations
-        except:
-            pass
+                recommendations = orjson.loads(json_match.group())
+                return self._normalize_scores(recommendations)
+        except (orjson.JSONDecodeError, ValueError, TypeError) as e:
+            logger.warning("Could not parse LLM recommendations: %s", e)
         
         # Fallback to empty recommendations
         return {}
     
+    def _parse_batch_recommendations(self, response_text: str) -> Dict[str, Dict[str, float]]:
+        """Parse a batched OpenAI response into recommendations keyed by client number"""
+        json_match = _JSON_RE.search(response_text)
+        if not json_match:
+            return {}
+        
+        batch = orjson.loads(json_match.group())
+        return {
+            str(number): self._normalize_scores(recommendations)
+            for number, recommendations in batch.items()
+            if isinstance(recommendations, dict)
+        }
+    
+    def _normalize_scores(self, recommendations: Dict) -> Dict[str, float]:
+        """Clamp scores of known products to the 0-1 range"""
+        for product in recommendations:
+            if product in self.products:
+                recommendations[product] = max(0, min(1, float(recommendations[product])))
+        return recommendations
+    
     def _rule_based_classification(self, client_profile: Dict) -> Dict[str, float]:
         """Fallback rule-based classification"""
-        recommendations = {}
+        return self._rule_based_classification_batch([client_profile])[0]
+    
+    def _rule_based_classification_batch(self, client_profiles: List[Dict]) -> List[Dict[str, float]]:
+        """Fallback rule-based classification for many clients as one (clients, products) score matrix"""
+        if not client_profiles:
+            return []
         
-        # Extract key metrics
+        features = np.array([self._fallback_features(profile) for profile in client_profiles], dtype=float)
+        return [
+            {product: float(score) for product, score in zip(_FALLBACK_PRODUCTS, row) if not np.isnan(score)}
+            for row in score_fallback_rules(features)
+        ]
+    
+    def _fallback_features(self, client_profile: Dict) -> Tuple[float, ...]:
+        """Extract the FALLBACK_FEATURES values from a client profile"""
         balance = client_profile.get('avg_monthly_balance_KZT', 0)
         currencies = client_profile.get('currencies_used', [])
         categories = client_profile.get('category_spending', {})
         patterns = client_profile.get('spending_patterns', {})
         
-        # High balance products
-        if balance > 6000000:
-            recommendations['Премиальная карта'] = 0.9
-            recommendations['Депозит Сберегательный'] = 0.8
-        elif balance > 1000000:
-            recommendations['Премиальная карта'] = 0.7
-            recommendations['Депозит Накопительный'] = 0.75
-        
-        # Multi-currency users
-        if len(currencies) > 2:
-            recommendations['Обмен валют'] = 0.85
-            recommendations['Депозит Мультивалютный'] = 0.8
-        
-        # Travel spending
-        if 'travel' in str(categories).lower() or 'transport' in str(categories).lower():
-            recommendations['Карта для путешествий'] = 0.85
-        
-        # High transaction diversity
-        if patterns.get('category_diversity', 0) > 5:
-            recommendations['Кредитная карта'] = 0.7
-        
-        # Low balance but active
-        if balance < 500000 and patterns.get('total_spending', 0) > balance * 2:
-            recommendations['Кредит наличными'] = 0.6
-            recommendations['Кредитная карта'] = 0.75
-        
-        # Investment potential
-        if balance > 2000000:
-            recommendations['Инвестиции'] = 0.7
-            recommendations['Золотые слитки'] = 0.6
+        has_travel = any(
+            keyword in category.lower()
+            for category in categories
+            for keyword in TRAVEL_CATEGORY_KEYWORDS
+        )
+        total_spending = patterns.get('total_spending', 0)
         
-        return recommendations
+        return (
+            balance,
+            len(currencies),
+            patterns.get('category_diversity', 0),
+            total_spending,
+            has_travel,
+            total_spending - balance * 2,
+        )
 
 # ============================================
 # API Endpoint Implementation
@@ -504,12 +893,24 @@ class BankingRecommendationAPI:
         logger.info("Initializing ProductRecommendationEngine")
         self.recommender = ProductRecommendationEngine(openai_api_key)
     
-    def load_data(self, clients_path: str, transactions_path: str, transfers_path: str):
-        """Load CSV data files"""
+    def load_data(self, clients_path: str, transactions_path: str, transfers_path: str, parquet_cache: bool = False):
+        """
+        Load CSV data files
+        
+        Args:
+            clients_path: Path to clients CSV
+            transactions_path: Path to transactions CSV
+            transfers_path: Path to transfers CSV
+            parquet_cache: Read typed Parquet copies next to the CSVs, writing them when missing or stale
+        """
         logger.info("Loading data: clients=%s, transactions=%s, transfers=%s", clients_path, transactions_path, transfers_path)
-        clients_df = pd.read_csv(clients_path)
-        transactions_df = pd.read_csv(transactions_path)
-        transfers_df = pd.read_csv(transfers_path)
+        clients_df = self._read_table(clients_path, CLIENT_DTYPES, parquet_cache=parquet_cache)
+        transactions_df = self._read_table(
+            transactions_path, OPERATION_DTYPES, parse_dates=['date'], parquet_cache=parquet_cache
+        )
+        transfers_df = self._read_table(
+            transfers_path, OPERATION_DTYPES, parse_dates=['date'], parquet_cache=parquet_cache
+        )
         
         logger.info(
             "Data loaded: clients=%d, transactions=%d, transfers=%d",
@@ -517,6 +918,35 @@ class BankingRecommendationAPI:
         )
         self.analyzer = ClientAnalyzer(clients_df, transactions_df, transfers_df)
     
+    def load_data_parquet(self, data_dir: str):
+        """Load clients.csv, all_transactions.csv and all_transfers.csv from data_dir via Parquet copies"""
+        self.load_data(
+            clients_path=os.path.join(data_dir, "clients.csv"),
+            transactions_path=os.path.join(data_dir, "all_transactions.csv"),
+            transfers_path=os.path.join(data_dir, "all_transfers.csv"),
+            parquet_cache=True
+        )
+    
+    @staticmethod
+    def _read_table(csv_path: str, dtype: Dict[str, str], parse_dates: Optional[List[str]] = None,
+                    parquet_cache: bool = False) -> pd.DataFrame:
+        """Read a CSV with the typed Arrow reader, optionally through a Parquet copy next to it"""
+        parquet_path = os.path.splitext(csv_path)[0] + ".parquet"
+        if parquet_cache and os.path.exists(parquet_path) and (
+            not os.path.exists(csv_path) or os.path.getmtime(parquet_path) >= os.path.getmtime(csv_path)
+        ):
+            logger.debug("Reading Parquet copy %s", parquet_path)
+            return pd.read_parquet(parquet_path)
+        
+        df = pd.read_csv(csv_path, engine='pyarrow', dtype=dtype, parse_dates=parse_dates)
+        if parquet_cache:
+            try:
+                df.to_parquet(parquet_path, compression='zstd', index=False)
+                logger.info("Wrote Parquet copy %s", parquet_path)
+            except OSError as e:
+                logger.warning("Could not write Parquet copy %s: %s", parquet_path, e)
+        return df
+    
     def get_recommendations(self, client_code: str, threshold: float = 0.5) -> Dict:
         """
         Get product recommendations for a client
@@ -542,6 +972,98 @@ class BankingRecommendationAPI:
         
         # Get recommendations
         recommendations = self.recommender.classify_client(profile)
+        return self._build_result(profile, recommendations, threshold)
+    
+    def get_recommendations_bulk(self, client_codes: List[str], threshold: float = 0.5) -> Dict[str, Dict]:
+        """
+        Get product recommendations for many clients at once
+        
+        Profiles are assembled in one pass, then classified in batched LLM requests
+        that run concurrently instead of back to back.
+        
+        Args:
+            client_codes: Client identifiers
+            threshold: Minimum confidence score to include recommendation
+            
+        Returns:
+            Dictionary mapping client_code to its recommendations (or error)
+        """
+        if not self.analyzer:
+            logger.error("Analyzer not initialized. Call load_data first.")
+            return {client_code: {"error": "Data not loaded. Please load CSV files first."} for client_code in client_codes}
+        
+        logger.info("Generating profiles and recommendations for %d clients", len(client_codes))
+        profiles = dict(zip(client_codes, self.analyzer.get_client_profiles(client_codes)))
+        valid_codes = [client_code for client_code, profile in profiles.items() if "error" not in profile]
+        
+        # One LLM request per CLASSIFY_BATCH_SIZE clients, with the batches in flight concurrently
+        batches = [
+            [profiles[client_code] for client_code in valid_codes[start:start + CLASSIFY_BATCH_SIZE]]
+            for start in range(0, len(valid_codes), CLASSIFY_BATCH_SIZE)
+        ]
+        with ThreadPoolExecutor(max_workers=MAX_CLASSIFY_WORKERS) as executor:
+            all_recommendations = [
+                recommendations
+                for batch_recommendations in executor.map(self.recommender.classify_clients_batch, batches)
+                for recommendations in batch_recommendations
+            ]
+        
+        results = {
+            client_code: self._build_result(profiles[client_code], recommendations, threshold)
+            for client_code, recommendations in zip(valid_codes, all_recommendations)
+        }
+        
+        return {client_code: results.get(client_code, profiles[client_code]) for client_code in client_codes}
+    
+    async def aget_recommendations_bulk(self, client_codes: List[str], threshold: float = 0.5) -> Dict[str, Dict]:
+        """
+        Async variant of get_recommendations_bulk
+        
+        Batches are classified with ainvoke/abatch on the event loop; a semaphore caps
+        the number of batches in flight at CLASSIFY_MAX_WORKERS.
+        
+        Args:
+            client_codes: Client identifiers
+            threshold: Minimum confidence score to include recommendation
+            
+        Returns:
+            Dictionary mapping client_code to its recommendations (or error)
+        """
+        if not self.analyzer:
+            logger.error("Analyzer not initialized. Call load_data first.")
+            return {client_code: {"error": "Data not loaded. Please load CSV files first."} for client_code in client_codes}
+        
+        logger.info("Generating profiles and recommendations for %d clients", len(client_codes))
+        profiles = dict(zip(client_codes, self.analyzer.get_client_profiles(client_codes)))
+        valid_codes = [client_code for client_code, profile in profiles.items() if "error" not in profile]
+        
+        semaphore = asyncio.Semaphore(MAX_CLASSIFY_WORKERS)
+        
+        async def classify_batch(batch_codes: List[str]) -> List[Dict[str, float]]:
+            async with semaphore:
+                return await self.recommender.aclassify_clients_batch(
+                    [profiles[client_code] for client_code in batch_codes]
+                )
+        
+        batches = [
+            valid_codes[start:start + CLASSIFY_BATCH_SIZE]
+            for start in range(0, len(valid_codes), CLASSIFY_BATCH_SIZE)
+        ]
+        all_recommendations = [
+            recommendations
+            for batch_recommendations in await asyncio.gather(*(classify_batch(batch) for batch in batches))
+            for recommendations in batch_recommendations
+        ]
+        
+        results = {
+            client_code: self._build_result(profiles[client_code], recommendations, threshold)
+            for client_code, recommendations in zip(valid_codes, all_recommendations)
+        }
+        
+        return {client_code: results.get(client_code, profiles[client_code]) for client_code in client_codes}
+    
+    def _build_result(self, profile: Dict, recommendations: Dict[str, float], threshold: float) -> Dict:
+        """Filter, rank and shape raw recommendation scores for a client profile"""
         logger.debug("Raw recommendations: %s", recommendations)
         
         # Filter by threshold
@@ -555,23 +1077,18 @@ class BankingRecommendationAPI:
             len(filtered_recommendations), threshold
         )
         
-        # Sort by score
-        sorted_recommendations = dict(
-            sorted(filtered_recommendations.items(), key=lambda x: x[1], reverse=True)
-        )
-        logger.debug("Sorted recommendations: %s", sorted_recommendations)
-        
-        # Derive structured output
-        product_type = next(iter(sorted_recommendations)) if sorted_recommendations else (
-            max(recommendations, key=recommendations.get) if recommendations else ""
-        )
+        # Derive structured output; only the best product is needed, so take the max
+        # (first of equal scores wins, as with a stable descending sort)
+        ranked = filtered_recommendations or recommendations
+        product_type = max(ranked.items(), key=itemgetter(1))[0] if ranked else ""
+        logger.debug("Top recommendation: %s", product_type)
         
         cat_spending = profile.get('category_spending', {}) or {}
-        top5_cat_items = sorted(cat_spending.items(), key=lambda x: x[1], reverse=True)[:5]
+        top5_cat_items = heapq.nlargest(5, cat_spending.items(), key=itemgetter(1))
         top_5_category_spending = {k: int(round(v)) for k, v in top5_cat_items}
         
         type_spending = profile.get('type_spending', {}) or {}
-        top5_type_items = sorted(type_spending.items(), key=lambda x: x[1], reverse=True)[:5]
+        top5_type_items = heapq.nlargest(5, type_spending.items(), key=itemgetter(1))
         top_5_type_spending = {k: int(round(v)) for k, v in top5_type_items}
         
         avg_balance_val = profile.get('avg_monthly_balance_KZT')
@@ -589,7 +1106,7 @@ class BankingRecommendationAPI:
         categories = profile.get('category_spending', {})
         if not categories:
             return None
-        return max(categories.items(), key=lambda x: x[1])[0]
+        return max(categories.items(), key=itemgetter(1))[0]
 
 # ============================================
 # Usage Example
@@ -601,25 +1118,21 @@ def main():
     # Initialize API with OpenAI key
     api = BankingRecommendationAPI(openai_api_key="your-openai-api-key-here")
     
-    # Load data
-    api.load_data(
-        clients_path="processed/clients.csv",
-        transactions_path="processed/all_transactions.csv",
-        transfers_path="processed/all_transfers.csv"
-    )
+    # Load data (typed Parquet copies are written next to the CSVs on first run)
+    api.load_data_parquet("processed")
     
     # Batch classify clients 1..60 and save to JSON array
     results = []
-    for client_code in range(1, 61):
-        res = api.get_recommendations(client_code, threshold=0.4)
+    bulk_results = asyncio.run(api.aget_recommendations_bulk(list(range(1, 61)), threshold=0.4))
+    for client_code, res in bulk_results.items():
         if isinstance(res, dict) and res.get("error"):
             logger.warning("Skipping client_code=%s due to error: %s", client_code, res.get("error"))
             continue
         results.append({"client_code": client_code, **res})
     
     output_path = os.path.join(os.path.dirname(__file__), 'processed', "product_classification.json")
-    with open(output_path, "w", encoding="utf-8") as f:
-        json.dump(results, f, ensure_ascii=False, indent=2)
+    with open(output_path, "wb") as f:
+        f.write(orjson.dumps(results, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS))
     
     print(f"Saved {len(results)} records to {output_path}")
 
@@ -6,6 +6,8 @@ This file contains only the essential prompt definitions and helper functions
 for generating banking push notifications. No Azure OpenAI integration.
 """
 
+import functools
+
 # =============================================================================
 # HELPER FUNCTIONS FOR DYNAMIC INSTRUCTIONS
 # =============================================================================
@@ -37,51 +39,55 @@ currency_symbols = {
 def get_currency_symbol(currency):
     return currency_symbols.get(currency, currency)
 
+# CTA variants per product
+cta_variants = {
+    "Карта для путешествий": (
+        "Оформить карту", "Откройте карту", "Подключить карту", 
+        "Хотите оформить?", "Оформить сейчас", "Заказать карту"
+    ),
+    "Премиальная карта": (
+        "Оформить сейчас", "Подключить карту", "Открыть карту",
+        "Оформить карту", "Активировать карту", "Заказать карту"
+    ),
+    "Кредитная карта": (
+        "Оформить карту", "Открыть карту", "Подключить карту",
+        "Заказать карту", "Оформить сейчас", "Активировать карту"
+    ),
+    "Обмен валют": (
+        "Настроить обмен", "Открыть обмен", "Подключить обмен",
+        "Активировать обмен", "Настроить сейчас", "Включить обмен"
+    ),
+    "Кредит наличными": (
+        "Узнать лимит", "Оформить кредит", "Проверить условия",
+        "Узнать условия", "Рассчитать кредит", "Подать заявку"
+    ),
+    "Депозит мультивалютный": (
+        "Открыть вклад", "Оформить депозит", "Подключить вклад",
+        "Создать вклад", "Открыть сейчас", "Оформить сейчас"
+    ),
+    "Депозит сберегательный": (
+        "Открыть вклад", "Оформить депозит", "Подключить вклад",
+        "Создать вклад", "Открыть сейчас", "Оформить сейчас"
+    ),
+    "Депозит накопительный": (
+        "Открыть вклад", "Оформить депозит", "Подключить вклад",
+        "Создать вклад", "Открыть сейчас", "Оформить сейчас"
+    ),
+    "Инвестиции": (
+        "Открыть счёт", "Начать инвестировать", "Подключить инвестиции",
+        "Создать счёт", "Открыть сейчас", "Начать сейчас"
+    ),
+    "Золотые слитки": (
+        "Купить золото", "Открыть счёт", "Подключить золото",
+        "Приобрести золото", "Купить сейчас", "Заказать золото"
+    )
+}
+
+default_cta_variants = ("Оформить сейчас", "Подключить", "Открыть")
+
 def get_cta_variants(product_type):
     """Get varied CTA options for different products"""
-    cta_variants = {
-        "Карта для путешествий": [
-            "Оформить карту", "Откройте карту", "Подключить карту", 
-            "Хотите оформить?", "Оформить сейчас", "Заказать карту"
-        ],
-        "Премиальная карта": [
-            "Оформить сейчас", "Подключить карту", "Открыть карту",
-            "Оформить карту", "Активировать карту", "Заказать карту"
-        ],
-        "Кредитная карта": [
-            "Оформить карту", "Открыть карту", "Подключить карту",
-            "Заказать карту", "Оформить сейчас", "Активировать карту"
-        ],
-        "Обмен валют": [
-            "Настроить обмен", "Открыть обмен", "Подключить обмен",
-            "Активировать обмен", "Настроить сейчас", "Включить обмен"
-        ],
-        "Кредит наличными": [
-            "Узнать лимит", "Оформить кредит", "Проверить условия",
-            "Узнать условия", "Рассчитать кредит", "Подать заявку"
-        ],
-        "Депозит мультивалютный": [
-            "Открыть вклад", "Оформить депозит", "Подключить вклад",
-            "Создать вклад", "Открыть сейчас", "Оформить сейчас"
-        ],
-        "Депозит сберегательный": [
-            "Открыть вклад", "Оформить депозит", "Подключить вклад",
-            "Создать вклад", "Открыть сейчас", "Оформить сейчас"
-        ],
-        "Депозит накопительный": [
-            "Открыть вклад", "Оформить депозит", "Подключить вклад",
-            "Создать вклад", "Открыть сейчас", "Оформить сейчас"
-        ],
-        "Инвестиции": [
-            "Открыть счёт", "Начать инвестировать", "Подключить инвестиции",
-            "Создать счёт", "Открыть сейчас", "Начать сейчас"
-        ],
-        "Золотые слитки": [
-            "Купить золото", "Открыть счёт", "Подключить золото",
-            "Приобрести золото", "Купить сейчас", "Заказать золото"
-        ]
-    }
-    return cta_variants.get(product_type, ["Оформить сейчас", "Подключить", "Открыть"])
+    return cta_variants.get(product_type, default_cta_variants)
 
 # =============================================================================
 # PROMPT 1: КАРТА ДЛЯ ПУТЕШЕСТВИЙ (TRAVEL CARD)
@@ -673,10 +679,17 @@ BANKING_PROMPTS = {
     "Золотые слитки": GOLD_BARS_PROMPT
 }
 
+# Product names, built once instead of on every lookup
+AVAILABLE_PRODUCTS = tuple(BANKING_PROMPTS)
+
+# Product for each prompt template, so formatting doesn't need to search the prompt text
+PRODUCT_BY_PROMPT = {prompt: name for name, prompt in BANKING_PROMPTS.items()}
+
 # =============================================================================
 # CORE FUNCTIONS
 # =============================================================================
 
+@functools.lru_cache(maxsize=None)
 def get_prompt_for_product(product_name: str) -> str:
     """
     Get the appropriate prompt for a given banking product.
@@ -716,10 +729,10 @@ def format_prompt_with_data(prompt: str, **kwargs) -> str:
         kwargs['currencies'] = str(currencies)
     
     # Add CTA variants for the product
-    product_name = kwargs.get('product', '')
+    product_name = kwargs.get('product', '') or PRODUCT_BY_PROMPT.get(prompt, '')
     if not product_name:
-        # Try to extract from prompt content
-        for product in get_available_products():
+        # Custom prompt: try to extract from prompt content
+        for product in AVAILABLE_PRODUCTS:
             if product in prompt:
                 product_name = product
                 break
@@ -731,4 +744,4 @@ def format_prompt_with_data(prompt: str, **kwargs) -> str:
 
 def get_available_products():
     """Get list of all available banking products"""
-    return list(BANKING_PROMPTS.keys())
+    return list(AVAILABLE_PRODUCTS)
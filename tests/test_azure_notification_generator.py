@@ -0,0 +1,210 @@
+"""
+Tests for the bulk Azure OpenAI paths of azure_notification_generator.py.
+
+Azure is replaced by a fake LLM that answers from the client codes in the prompt,
+and the response cache lives in a temporary directory.
+Run from the repository root: python -m unittest discover tests
+"""
+
+import os
+import re
+import asyncio
+import tempfile
+import unittest
+from unittest import mock
+
+import orjson
+
+import azure_notification_generator as generator
+
+PRODUCT = "Кредитная карта"
+CLIENT_CODE = re.compile(r"client_code: (\d+)")
+
+
+def make_client(client_code: int, product_type: str = PRODUCT) -> dict:
+    """Client record shaped like an entry of product_classification.json"""
+    return {
+        "client_code": client_code,
+        "name": f"Клиент {client_code}",
+        "status": "Стандартный клиент",
+        "age": 30 + client_code,
+        "city": "Алматы",
+        "avg_monthly_balance": 100000 * client_code,
+        "currencies": ["KZT"],
+        "product_type": product_type,
+        "top_5_category_spending": {"Такси": 15000 * client_code, "Кафе и рестораны": 20000},
+        "top_5_type_spending": {"card_out": 50000 * client_code},
+    }
+
+
+def notification(client_code: int) -> dict:
+    return {"client_code": client_code, "product": PRODUCT, "push_notification": f"Уведомление {client_code}"}
+
+
+def answer(prompt: str, keep: int = None) -> str:
+    """JSON reply for every client in the prompt; batched prompts get only the first `keep` clients"""
+    codes = [int(code) for code in CLIENT_CODE.findall(prompt)]
+    if len(codes) == 1:
+        return orjson.dumps(notification(codes[0])).decode()
+    return orjson.dumps({"notifications": [notification(code) for code in codes[:keep]]}).decode()
+
+
+class FakeLLM:
+    """Stands in for AzureChatOpenAI and records every prompt it receives"""
+
+    def __init__(self, keep: int = None):
+        self.keep = keep
+        self.prompts = []
+
+    def _reply(self, messages):
+        prompt = messages[-1].content
+        self.prompts.append(prompt)
+        return mock.Mock(content=answer(prompt, self.keep))
+
+    def invoke(self, messages, **kwargs):
+        return self._reply(messages)
+
+    async def ainvoke(self, messages, **kwargs):
+        await asyncio.sleep(0)
+        return self._reply(messages)
+
+
+class BulkGenerationTestCase(unittest.TestCase):
+    """Installs a fake LLM and an empty on-disk cache for each test"""
+
+    keep = None
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        cache = generator.NotificationCache(os.path.join(cache_dir.name, "cache"))
+        self.addCleanup(cache.close)
+
+        self.llm = FakeLLM(self.keep)
+        get_llm = mock.Mock(return_value=self.llm)
+        get_llm.discard = mock.Mock(return_value=None)
+        for name, value in (
+            ("_notification_cache", cache),
+            ("get_azure_llm", get_llm),
+            ("get_async_azure_llm", get_llm),
+        ):
+            patcher = mock.patch.object(generator, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def generate(self, clients: list, **kwargs) -> list:
+        return generator.run_async(generator.agenerate_client_notifications(clients, **kwargs))
+
+
+class MarshaledPromptTest(BulkGenerationTestCase):
+    keep = 1  # Every batched reply drops all clients but the first
+
+    def test_dropped_clients_are_retried_individually(self):
+        clients = [make_client(code) for code in range(1, 6)]
+
+        with self.assertLogs(generator.logger, "WARNING") as logs:
+            results = self.generate(clients, clients_per_prompt=5)
+
+        self.assertEqual(results, [notification(code) for code in range(1, 6)])
+        # One marshaled prompt, then one call for each of the four dropped clients
+        self.assertEqual(len(self.llm.prompts), 5)
+        self.assertIn("<CLIENT 5>", self.llm.prompts[0])
+        self.assertTrue(any("left out 4 of 5" in line for line in logs.output))
+
+    def test_single_client_chunk_is_sent_alone(self):
+        clients = [make_client(code) for code in range(1, 4)]
+
+        with self.assertNoLogs(generator.logger, "WARNING"):
+            results = self.generate(clients[2:], clients_per_prompt=5)
+
+        self.assertEqual(results, [notification(3)])
+        self.assertNotIn("<CLIENT", self.llm.prompts[0])
+
+    def test_non_azure_products_use_templates(self):
+        clients = [make_client(1), make_client(2, product_type="Инвестиции"), make_client(3, product_type="Инвестиции")]
+
+        results = self.generate(clients, clients_per_prompt=5)
+
+        self.assertEqual(results[0], notification(1))
+        self.assertEqual([result["product"] for result in results[1:]], ["Инвестиции", "Инвестиции"])
+        self.assertEqual(len(self.llm.prompts), 1)
+
+
+class ProductDataTest(unittest.TestCase):
+
+    def test_vectorized_extraction_renders_the_same_prompts(self):
+        # Each product twice; the second client's amounts are fractional or missing, the first's whole numbers
+        products = list(generator.PRODUCT_DATA_EXTRACTORS)
+        clients = [make_client(code, product_type) for code, product_type in enumerate(products * 2, 1)]
+        for client_data in clients[len(products):]:
+            client_data["top_5_category_spending"] = {"Такси": 232520.5, "Путешествия": 1000.0}
+            client_data["top_5_type_spending"] = {"card_out": 5000.5, "fx_buy": 2500000.25}
+
+        for client_data, product_data in zip(clients, generator.extract_all_product_data(clients)):
+            product_name = client_data["product_type"]
+            with self.subTest(product=product_name):
+                self.assertEqual(
+                    generator._build_prompt(product_name, product_data),
+                    generator._build_prompt(product_name, generator.extract_product_specific_data(client_data, product_name))
+                )
+
+
+class BatchAPITest(BulkGenerationTestCase):
+
+    def test_failed_job_falls_back_to_realtime_calls(self):
+        clients = [make_client(code) for code in range(1, 4)]
+        failure = RuntimeError("Batch batch_1 finished with status: expired")
+
+        with mock.patch.object(generator, "submit_batch", side_effect=failure), \
+                self.assertLogs(generator.logger, "ERROR"):
+            results = generator.generate_notifications_with_batch_api(clients)
+
+        self.assertEqual(results, [notification(code) for code in range(1, 4)])
+        self.assertTrue(self.llm.prompts)
+
+    def test_clients_missing_from_the_output_are_retried(self):
+        clients = [make_client(code) for code in range(1, 4)]
+
+        def submit_batch(prompts):
+            # The job completes, but the second request has no response
+            return {
+                custom_id: None if custom_id.startswith("1-") else answer(prompt)
+                for custom_id, prompt in prompts.items()
+            }
+
+        with mock.patch.object(generator, "submit_batch", side_effect=submit_batch), \
+                self.assertLogs(generator.logger, "ERROR"):
+            results = generator.generate_notifications_with_batch_api(clients)
+
+        self.assertEqual(results, [notification(code) for code in range(1, 4)])
+        self.assertEqual(len(self.llm.prompts), 1)
+        self.assertEqual(CLIENT_CODE.findall(self.llm.prompts[0]), ["2"])
+
+
+class CachedRerunTest(BulkGenerationTestCase):
+
+    def test_rerun_is_served_from_the_cache(self):
+        clients = [make_client(code) for code in range(1, 10)]
+        first = self.generate(clients, clients_per_prompt=4)
+        calls = len(self.llm.prompts)
+
+        with mock.patch.object(generator.AsyncRateLimiter, "acquire", autospec=True) as acquire:
+            second = self.generate(clients, clients_per_prompt=4)
+
+        self.assertEqual(second, first)
+        self.assertEqual(len(self.llm.prompts), calls)
+        acquire.assert_not_called()
+
+    def test_batch_api_rerun_submits_nothing(self):
+        clients = [make_client(code) for code in range(1, 4)]
+        self.generate(clients)
+
+        with mock.patch.object(generator, "submit_batch") as submit_batch:
+            results = generator.generate_notifications_with_batch_api(clients)
+
+        self.assertEqual(results, [notification(code) for code in range(1, 4)])
+        submit_batch.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()